@@ -1,37 +1,334 @@
 #!/usr/bin/env python
-from naoqi import ALBroker, ALProxy
+try:
+    from naoqi import ALBroker, ALProxy, ALModule
+except ImportError:
+    ALBroker = ALProxy = ALModule = None
+from lib.FakeMemory import FakeALMemory, FakeALBroker, FakeALModule
 from sys import stdout, exit
 from os import system
 from re import compile, search
-from lib.UnbufferedStreamWrapper import *
+from time import time, sleep
+from Queue import Queue, Empty
+from lib.Output import CoalescingStreamWrapper
+from lib.SampleRing import SampleRing
+from lib.Instrumentation import Samples
+from multiprocessing.pool import ThreadPool
 import argparse
 
+WATCHER_NAME = 'BoardMemoryWatcher'
+
+
+def watcherClass(base):
+    class MemoryWatcher(base):
+        '''Receives the change notifications of the watched keys'''
+        def __init__(self, name):
+            base.__init__(self, name)
+            self.changes = Queue()
+
+        def onChange(self, key, value, message):
+            """Callback of the ALMemory micro events"""
+            self.changes.put((time(), key, value))
+
+    return MemoryWatcher
+
 
 class BoardMemoryMonitor(object):
-    def __init__(self, args):
+    def __init__(self, args, out=stdout, memory=None):
+        '''
+        `memory` replaces the ALMemory proxy (or the --fake stand-in), its
+        updates are then left to the caller
+        '''
         self._prefix = 'Device/DeviceList'
-        self._board = args.board
-        self._key = args.key
+        self._period = 1. / args.rate if args.rate > 0 else 0.
+        self._keys = args.key or ['Error']
+        self._events = args.events
+        self._maxCycles = args.cycles
+        self._cycles = 0
+        self._changes = 0
+        self._errors = 0
+        self._broker = None
+        self._watcher = None
+        self._logIO = None
+        self._subscribed = []
         try:
-            self._mem = ALProxy('ALMemory', args.url, args.port)
-            self._out = UnbufferedStreamWrapper(stdout)
+            if memory is not None:
+                self._mem = memory
+                if self._events:
+                    self._watcher = watcherClass(FakeALModule)(WATCHER_NAME)
+            elif args.fake:
+                self._mem = FakeALMemory(args.board or ['ZeBoard'],
+                                         latency=args.fake_latency / 1000.,
+                                         seed=0)
+                if self._events:
+                    self._broker = FakeALBroker(self._mem)
+                    self._watcher = watcherClass(FakeALModule)(WATCHER_NAME)
+            elif ALProxy is None:
+                print 'naoqi is not available, use --fake to monitor a ' \
+                    'local ALMemory stand-in'
+                exit(1)
+            else:
+                if self._events:
+                    # Local broker hosting the module ALMemory calls back
+                    self._broker = ALBroker('boardMemoryMonitorBroker',
+                                            '0.0.0.0', 0, args.url,
+                                            args.port)
+                    # NAOqi finds the module instance by its global name
+                    self._watcher = globals()[WATCHER_NAME] = \
+                        watcherClass(ALModule)(WATCHER_NAME)
+                self._mem = ALProxy('ALMemory', args.url, args.port)
+            self._boards = args.board or ['ZeBoard']
+            if args.all_boards:
+                self._boards = self._discoverBoards()
+            self._out = CoalescingStreamWrapper(out)
         except RuntimeError as e:
             exceptRgx = compile('[^\n\t]+$')
             print '\n', 'RuntimeError:', exceptRgx.search(e.args[0]).group(0)
+            self.shutdown()
             exit(1)
+        # Key paths are built once, the loop only does one round-trip
+        self._names = [board + '/' + key
+                       for board in self._boards for key in self._keys]
+        self._paths = [self._prefix + '/' + name for name in self._names]
+        self._isError = [name.endswith('/Error') for name in self._names]
+        if len(args.log):
+            self._logIO = open(args.log, 'a')
+            self._logIO.write('Time,Key,Value\n')
+
+    def _discoverBoards(self):
+        suffix = '/ProgVersion'
+        return [k[len(self._prefix) + 1:-len(suffix)]
+                for k in self._mem.getDataList(self._prefix + '/')
+                if k.endswith(suffix)]
+
+    def _subscribe(self):
+        try:
+            for p in self._paths:
+                self._mem.subscribeToMicroEvent(p, WATCHER_NAME, '',
+                                                'onChange')
+                self._subscribed.append(p)
+        except RuntimeError as e:
+            exceptRgx = compile('[^\n\t]+$')
+            print 'Subscription failed ({0}), polling instead'.format(
+                exceptRgx.search(e.args[0]).group(0))
+            self._unsubscribe()
+            return False
+        return True
+
+    def _unsubscribe(self):
+        for p in self._subscribed:
+            try:
+                self._mem.unsubscribeToMicroEvent(p, WATCHER_NAME)
+            except RuntimeError:
+                pass
+        self._subscribed = []
+
+    def _running(self):
+        return not self._maxCycles or self._cycles < self._maxCycles
+
+    def _write(self, changes):
+        '''Print and log (receive time, index, value) changes'''
+        self._changes += len(changes)
+        isError = self._isError
+        self._errors += sum(1 for ts, i, value in changes
+                            if value and isError[i])
+        self._out.write(''.join([
+            '{0:10.3f} {1}: {2}\n'.format(ts - self._start, self._names[i],
+                                          str(value))
+            for ts, i, value in changes]))
+        if self._logIO:
+            self._logIO.write(''.join([
+                '{0:.6f},{1},{2}\n'.format(ts, self._names[i], str(value))
+                for ts, i, value in changes]))
 
     def run(self):
-        progVersion = self._mem.getData('/'.join([self._prefix,
-                                        self._board,
-                                        'ProgVersion']))
+        progVersions = self._mem.getListData([
+            '/'.join([self._prefix, board, 'ProgVersion'])
+            for board in self._boards])
+        events = self._events and self._subscribe()
         system('clear')
-        print 'Monitoring key \'{0}\' on board \'{1}\' [ProgVersion: {2}]'.format(self._key,
-                                                                                  self._board,
-                                                                                  str(progVersion))
-        while True:
-            data = self._mem.getData('/'.join([self._prefix, self._board, self._key]))
-            self._out.write(str(data))
-            self._out.write('   \r')
+        if events:
+            how = 'on change'
+        elif self._period:
+            how = 'at {0:g} Hz'.format(1. / self._period)
+        else:
+            how = 'at full speed'
+        print 'Monitoring {0} key(s) on {1} board(s) {2}'.format(
+            len(self._keys), len(self._boards), how)
+        for board, progVersion in zip(self._boards, progVersions):
+            print '  {0} [ProgVersion: {1}]'.format(board, str(progVersion))
+        self._start = time()
+        if events:
+            self._runEvents()
+        else:
+            self._runPolling()
+
+    def _runEvents(self):
+        # Current values first, then every notification as it comes
+        data = self._mem.getListData(self._paths)
+        self._write([(self._start, i, v) for i, v in enumerate(data)])
+        index = dict((p, i) for i, p in enumerate(self._paths))
+        queue = self._watcher.changes
+        while self._running():
+            try:
+                # A timeout keeps the wait interruptible
+                changes = [queue.get(True, .5)]
+            except Empty:
+                continue
+            while True:
+                try:
+                    changes.append(queue.get_nowait())
+                except Empty:
+                    break
+            self._cycles += 1
+            self._write([(ts, index[key], value)
+                         for ts, key, value in changes])
+
+    def _runPolling(self):
+        last = [None] * len(self._paths)
+        deadline = self._start
+        while self._running():
+            data = self._mem.getListData(self._paths)
+            now = time()
+            self._cycles += 1
+            changed = [(now, i, new) for i, (old, new) in
+                       enumerate(zip(last, data)) if old != new]
+            if changed:
+                self._write(changed)
+                last = data
+            if self._period:
+                deadline += self._period
+                if deadline > now:
+                    sleep(deadline - now)
+                else:
+                    # Too slow for the requested rate, don't try to catch up
+                    deadline = now
+
+    def shutdown(self):
+        self._unsubscribe()
+        if self._broker:
+            self._broker.shutdown()
+            self._broker = None
+        if self._logIO:
+            self._logIO.close()
+            self._logIO = None
+
+    def report(self):
+        self._out.close()
+        elapsed = time() - getattr(self, '_start', time())
+        print '{0} {1} ({2:.1f}/s), {3} changes, {4} error codes'.format(
+            self._cycles,
+            'notification batches' if self._subscribed else 'round-trips',
+            self._cycles / elapsed if elapsed else 0, self._changes,
+            self._errors)
+        if isinstance(self._mem, FakeALMemory):
+            print 'ALMemory stand-in: {0} round-trips, {1} keys read, {2} ' \
+                'error pulses'.format(self._mem.roundTrips,
+                                      self._mem.keysRead, self._mem.pulses)
+        self.shutdown()
+
+
+class BoardSampler(BoardMemoryMonitor):
+    '''
+    Samples every board in parallel, one getListData round-trip per board
+    and per cycle, into a fixed size history per key.
+    '''
+    def __init__(self, args, out=stdout, memory=None):
+        super(BoardSampler, self).__init__(args, out, memory)
+        self._jobs = args.jobs or min(8, len(self._boards))
+        self._dump = args.dump
+        n = len(self._keys)
+        self._boardPaths = [self._paths[b * n:(b + 1) * n]
+                            for b in range(len(self._boards))]
+        self._history = [SampleRing(args.history) for p in self._paths]
+        # Percentiles over the last --history cycles
+        window = args.history * len(self._boards)
+        self._latency = Samples('us', window)
+        self._jitter = Samples('us', window)
+        self._pool = None
+
+    def _sample(self, b):
+        t0 = time()
+        values = self._mem.getListData(self._boardPaths[b])
+        return t0, time(), values
+
+    def _draw(self, values):
+        width = max(len(b) for b in self._boards)
+        lines = ['\x1b[H{0:{w}}  '.format('', w=width) + '  '.join(
+            '{0:>12}'.format(k) for k in self._keys)]
+        n = len(self._keys)
+        for b, board in enumerate(self._boards):
+            lines.append('{0:{w}}  '.format(board, w=width) + '  '.join(
+                '{0:>12}'.format(str(v)) for v in values[b * n:(b + 1) * n]))
+        lines.append('{0} cycles  RPC latency p50={1:.0f} us '
+                     'p99={2:.0f} us  jitter p99={3:.0f} us'.format(
+                         self._cycles, self._latency.percentile(50),
+                         self._latency.percentile(99),
+                         self._jitter.percentile(99)))
+        self._out.write('\x1b[K\n'.join(lines) + '\x1b[K\n')
+
+    def run(self):
+        system('clear')
+        self._pool = ThreadPool(self._jobs)
+        self._start = time()
+        deadline = self._start
+        last = None
+        lastDraw = 0
+        boards = range(len(self._boards))
+        while self._running():
+            # map_async().get() with a timeout stays interruptible
+            results = self._pool.map_async(self._sample, boards).get(3600)
+            self._cycles += 1
+            values = []
+            i = 0
+            for t0, t1, data in results:
+                self._latency.add((t1 - t0) * 1e6)
+                self._jitter.add(max(0., t0 - deadline) * 1e6)
+                for v in data:
+                    self._history[i].append(t1, v)
+                    i += 1
+                values.extend(data)
+            now = time()
+            if values != last or now - lastDraw >= 1:
+                if last is not None:
+                    self._changes += sum(1 for a, b in zip(last, values)
+                                         if a != b)
+                self._draw(values)
+                last = values
+                lastDraw = now
+            if self._period:
+                deadline += self._period
+                if deadline > now:
+                    sleep(deadline - now)
+                else:
+                    deadline = now
+            else:
+                deadline = now
+
+    def report(self):
+        self._out.close()
+        if self._pool:
+            self._pool.terminate()
+        for name, h in (('RPC latency', self._latency),
+                        ('Sampling jitter', self._jitter)):
+            print '{0}: p50={1:.0f} p90={2:.0f} p99={3:.0f} max={4:.0f} ' \
+                'us'.format(name, h.percentile(50), h.percentile(90),
+                            h.percentile(99), h.max or 0)
+        for name, ring in zip(self._names, self._history):
+            times, values = ring.samples()
+            print '  {0}: {1} samples, {2} changes, min={3:g} max={4:g}' \
+                .format(name, ring.count, ring.changes(),
+                        min(values) if len(values) else 0,
+                        max(values) if len(values) else 0)
+        if len(self._dump):
+            with open(self._dump, 'w') as f:
+                f.write('Time,Key,Value\n')
+                for name, ring in zip(self._names, self._history):
+                    times, values = ring.samples()
+                    f.write(''.join(['{0:.6f},{1},{2:g}\n'.format(t, name, v)
+                                     for t, v in zip(times, values)]))
+        # One round-trip per board and per cycle
+        self._cycles *= len(self._boards)
+        super(BoardSampler, self).report()
 
 
 def main():
@@ -39,23 +336,87 @@ def main():
     p.add_argument('-u', '--url',
                    default='bn9.local')
     p.add_argument('-p', '--port',
+                   type=int,
                    default=9559)
     p.add_argument('-b', '--board',
-                   default='ZeBoard')
+                   action='append',
+                   help='Board to monitor (repeatable, default: ZeBoard)')
+    p.add_argument('-a', '--all-boards',
+                   default=False,
+                   action='store_true',
+                   help='Monitor every board found under Device/DeviceList')
     p.add_argument('-k', '--key',
-                   default='Error')
+                   action='append',
+                   help='Key to monitor on every board (repeatable, \
+                       default: Error)')
+    p.add_argument('-r', '--rate',
+                   type=float,
+                   default=10.,
+                   metavar='HZ',
+                   help='Sampling rate, one batched read per cycle \
+                       (0 for full speed)')
+    p.add_argument('-e', '--events',
+                   default=False,
+                   action='store_true',
+                   help='Subscribe to the changes of the watched keys \
+                       instead of polling them (polls at --rate when the \
+                       subscription fails)')
+    p.add_argument('-l', '--log',
+                   default='',
+                   metavar='FILE',
+                   help='Append every change with its receive time to the \
+                       CSV file FILE')
+    p.add_argument('-s', '--sampler',
+                   default=False,
+                   action='store_true',
+                   help='Sample all the boards in parallel at --rate, \
+                       keeping a history of every key')
+    p.add_argument('-j', '--jobs',
+                   type=int,
+                   default=0,
+                   metavar='N',
+                   help='(sampler) Concurrent round-trips \
+                       (default: one per board, up to 8)')
+    p.add_argument('--history',
+                   type=int,
+                   default=3600,
+                   metavar='N',
+                   help='(sampler) Samples kept per key')
+    p.add_argument('--dump',
+                   default='',
+                   metavar='FILE',
+                   help='(sampler) Save the history as CSV into FILE on exit')
+    p.add_argument('--fake',
+                   default=False,
+                   action='store_true',
+                   help='Monitor a local simulated ALMemory instead of \
+                       the robot')
+    p.add_argument('--fake-latency',
+                   type=float,
+                   default=0.,
+                   metavar='MS',
+                   help='Round-trip latency of the simulated ALMemory')
+    p.add_argument('-n', '--cycles',
+                   type=int,
+                   default=0,
+                   metavar='N',
+                   help='Stop after N cycles (0: run until interrupted)')
     args = p.parse_args()
-    mon = BoardMemoryMonitor(args)
+    if args.sampler and args.events:
+        p.error('--sampler and --events are exclusive')
+    mon = (BoardSampler if args.sampler else BoardMemoryMonitor)(args)
 
     try:
         mon.run()
     except RuntimeError as e:
         exceptRgx = compile('[^\n\t]+$')
         print '\n', 'RuntimeError:', exceptRgx.search(e.args[0]).group(0)
+        mon.shutdown()
         exit(1)
     except KeyboardInterrupt:
         pass
 
+    mon.report()
     print '\r\nExiting monitor'
 
 if __name__ == "__main__":
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Micro-benchmark of the DTS frame CRC: historical bitwise loop against the
+table-driven lib.CRC implementation.
+"""
+from lib.CRC import CRC8, crc8Bitwise, selfCheck
+from random import randint
+from time import time
+import argparse
+
+SOF = '\x73\x95\xDB\x42'
+
+
+def makeFrames(count, dataSize):
+    frames = []
+    for n in range(count):
+        frame = SOF + ''.join(chr(randint(0, 255)) for i in range(dataSize))
+        frames.append((frame, chr(crc8Bitwise(frame))))
+    return frames
+
+
+def bench(label, fn, nbFrames, frameSize, repeat):
+    best = None
+    for r in range(repeat):
+        t = time()
+        fn()
+        t = time() - t
+        best = t if best is None or t < best else best
+    print '{0:<12} {1:>10.3f} ms  {2:>12.0f} frames/s  {3:>8.2f} MB/s'.format(
+        label, best * 1000, nbFrames / best,
+        nbFrames * frameSize / best / 1e6)
+    return best
+
+
+def main():
+    p = argparse.ArgumentParser(prog='CRCBenchmark.py',
+                                description='Benchmark DTS CRC checking.')
+    p.add_argument('--frames', '-f',
+                   type=int,
+                   default=10000,
+                   metavar='N',
+                   help='Number of frames per run')
+    p.add_argument('--size', '-s',
+                   type=int,
+                   default=16,
+                   metavar='BYTES',
+                   help='Payload size of a frame (SOF excluded)')
+    p.add_argument('--repeat', '-r',
+                   type=int,
+                   default=3,
+                   metavar='N',
+                   help='Keep the best of N runs')
+    a = p.parse_args()
+
+    if not selfCheck():
+        print 'CRC table does not match the bitwise implementation'
+        return
+    frames = makeFrames(a.frames, a.size)
+    frameSize = a.size + len(SOF)
+    buf = bytearray()
+    offsets = []
+    for frame, crc in frames:
+        offsets.append(len(buf))
+        buf += frame + crc
+
+    def bitwise():
+        for frame, crc in frames:
+            assert crc8Bitwise(frame) == ord(crc)
+
+    def table():
+        for frame, crc in frames:
+            assert CRC8.check(frame, crc)
+
+    def batch():
+        assert all(CRC8.checkBatch(buf, offsets, frameSize))
+
+    print 'CRC-8 over {0} frames of {1} bytes'.format(a.frames, frameSize)
+    ref = bench('bitwise', bitwise, a.frames, frameSize, a.repeat)
+    for label, fn in (('table', table), ('table-batch', batch)):
+        t = bench(label, fn, a.frames, frameSize, a.repeat)
+        print '{0:<12} x{1:.1f}'.format('', ref / t)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,15 +8,21 @@ Last Update on 2014/09/17
 Author: Samir Ahamada
 Contact: sahamada@aldebaran.com
 """
-from lib.Output import UnbufferedStreamWrapper
-from pylibftdi import Device
-from pylibftdi import FtdiError
-from sys import stdout
+from lib.Output import openOutput, addOutputArguments
+from lib.FrameParser import FrameParser, ErrorBudget, SOF
+from lib.FrameDecoder import BatchDecoder
+from lib.FrameLog import FrameLogWriter
+from lib.Acquisition import ThreadedSource
+from lib.Dashboard import Dashboard
+from lib.Descriptor import compileDescriptor, DescriptorException
+from lib.Instrumentation import PipelineStats
+from lib.Trigger import TriggerGate, TriggerException
+from lib.ByteSource import FtdiError, openSource, addSourceArguments
+from lib.Callback import weakMethod
+from sys import stdout, stderr
+from time import time
 from os import system, path
-from time import sleep
-from struct import unpack
 import argparse
-import json
 
 normColor = '\x1b[0;0m'
 lablColor = '\x1b[33m'
@@ -36,53 +42,72 @@ class DTSAnalyzer(object):
     def __init__(self, a, mode='t', baudrate=1250000,
                  databits=8, stopbits=0, paritymode=2):
 
-        self.__endianKeys = {'B': '>', 'L': '<'}
-        self.__typeKeys = {
-            "sInt16": {"key": 'h', "size": 2},
-            "uInt16": {"key": 'H', "size": 2},
-            "sInt32": {"key": 'i', "size": 4},
-            "uInt32": {"key": 'I', "size": 4},
-            "sInt64": {"key": 'q', "size": 8},
-            "uInt64": {"key": 'Q', "size": 8},
-            "float": {"key": 'f', "size": 4},
-            "double": {"key": 'd', "size": 8},
-            "byte": {"key": 'x', "size": 1}
-            }
-        self.__sof = ['\x73', '\x95', '\xDB', '\x42']
+        self.__closed = False
+        self.__sof = SOF
         self.__structDescFile = a.desc
         self.__logFile = a.log
+        self.__binLog = a.log_format == 'bin'
         self.__noStdoutPrint = a.no_stdout
         self.__displayFrameNb = a.frame_number
         self.__lineSep = '\n' if a.newline else '\r'
+        self.__dashboardRate = a.dashboard
+        self.__dashboard = None
+        self.__stats = PipelineStats()
+        self.__statsPeriod = a.stats
+        self.__statsFile = a.stats_file
+        self.__threaded = a.threaded
+        self.__lastStats = time()
+        self.__triggerExpr = a.trigger
+        self.__preTrigger = a.pre_trigger
+        self.__postTrigger = a.post_trigger
+        self.__trigger = None
+        self.__crcBudget = ErrorBudget(a.crc_budget, a.crc_window)
         self.__logIO = None
         self.__labels = []
-        self.__buffer = []
+        self.__parser = None
+        self.__desc = None
         self.__structDesc = {}
         self.__decoder = ''
+        self.__batchDecoder = None
+        self.__droppedBytes = 0
         self.__dataSize = 0
-        self.__sofok = 0
-        self.__start = 0
-        self.__frameNb = 0
+        self.__d = None
+        self.__out = None
 
-        self.__out = UnbufferedStreamWrapper(stdout)
         try:
-            self.__d = Device()
-            self.__d.baudrate = baudrate
-            self.__d.ftdi_fn.ftdi_set_line_property(databits,
-                                                    stopbits,
-                                                    paritymode)
-            self.__d.flush()
-        except FtdiError as e:
-            self.__d = None
-            raise FtdiError('could not start FTDI Device "' + e.args[0] + '"')
-
-        if a.no_stdout and not len(a.log):
-            raise DTSAnalyzerException(
-                'init', 'Neither file logging or stdout printing enabled')
-
-        self.__initDts()
+            self.__out = openOutput(a, stdout)
+            self.__d = openSource(a, baudrate, databits, stopbits,
+                                  paritymode)
+            if a.threaded:
+                self.__d = ThreadedSource(
+                    self.__d, a.queue_size, None,
+                    onOverflow=weakMethod(self.__onOverflow),
+                    stats=self.__stats)
+
+            if a.no_stdout and not len(a.log):
+                raise DTSAnalyzerException(
+                    'init', 'Neither file logging or stdout printing enabled')
+
+            self.__initDts()
+        except:
+            # Don't leave the device open behind a failed construction
+            self.close()
+            raise
 
     def __del__(self):
+        self.close()
+
+    def close(self):
+        # Callbacks are weak methods, so that __del__ runs as soon as the
+        # analyzer is dropped; main() still closes it explicitly on exit
+        if self.__closed:
+            return
+        self.__closed = True
+        if self.__out:
+            self.__out.close()
+        if getattr(self.__out, 'droppedBytes', 0):
+            print normColor + '\n{0} bytes of terminal output dropped'.format(
+                self.__out.droppedBytes)
         if self.__logIO and not self.__logIO.closed:
             print '\nClosing log file'
             self.__logIO.close()
@@ -103,54 +128,51 @@ class DTSAnalyzer(object):
                            self.__structDescFile + '\'')
         if self.__noStdoutPrint:
             self.__out.writeln('Stdout printing disabled')
-        if isinstance(self.__logIO, file):
-            self.__out.writeln('Logging to file: \'' + self.__logFile + '\'')
+        if self.__logIO is not None:
+            self.__out.writeln('Logging to file: \'' + self.__logFile + '\'' +
+                               (' [binary]' if self.__binLog else ''))
+        if self.__trigger:
+            self.__out.writeln('Trigger: {0} [{1} frames before, {2} after]'
+                               .format(self.__triggerExpr, self.__preTrigger,
+                                       self.__postTrigger))
+        if self.__dashboardRate and not self.__noStdoutPrint:
+            self.__dashboard = Dashboard(
+                self.__out, self.__labels, self.__dashboardRate,
+                'Analyzer started : Baudrate={0}  Descriptor: \'{1}\''.format(
+                    self.__d.baudrate, self.__structDescFile))
+            system('clear')
 
     def __loadStructDesc(self):
-        with open(self.__structDescFile) as f:
+        try:
+            self.__desc = compileDescriptor(self.__structDescFile)
+        except DescriptorException as e:
+            raise DTSAnalyzerException(e.sender, e.msg)
+        self.__structDesc = self.__desc.desc
+        self.__decoder = self.__desc.format
+        self.__labels = self.__desc.labels
+        self.__dataSize = self.__desc.dataSize
+        self.__parser = FrameParser(self.__dataSize,
+                                    weakMethod(self.__onCrcError),
+                                    self.__sof, weakMethod(self.__onResync))
+        self.__batchDecoder = BatchDecoder(self.__decoder, self.__labels)
+        if len(self.__triggerExpr):
             try:
-                self.__structDesc = json.loads(f.read())
-            except ValueError as e:
-                raise DTSAnalyzerException('loadStructDesc:json.loads',
-                                           e.args[0])
-
-        if not type(self.__structDesc) == dict or \
-            not len(self.__structDesc) == 2 or \
-                'endianess' not in self.__structDesc.keys() or \
-                'items' not in self.__structDesc.keys():
-            raise DTSAnalyzerException('loadFrameDesc',
-                                       'Invalid frame descriptor')
-
-        if not self.__structDesc['endianess'] in self.__endianKeys:
-            raise DTSAnalyzerException('loadFrameDesc',
-                                       'Unrecognized endianess')
-        self.__decoder = self.__endianKeys[self.__structDesc['endianess']]
-
-        if type(self.__structDesc['items']) != list:
-            raise DTSAnalyzerException('loadFrameDesc',
-                                       'Unrecognized item list format')
-
-        for item in self.__structDesc['items']:
-            if type(item) != dict or \
-                    len(item.values()) != 1 or len(item.keys()) != 1:
-                raise DTSAnalyzerException('loadFrameDesc',
-                                           'Unrecognized item size')
-
-            if not item.values()[0] in self.__typeKeys:
-                raise DTSAnalyzerException('loadFrameDesc',
-                                           'Unrecognized item type')
-
-            typeStr = item.values()[0].encode('ascii')
-            self.__decoder += self.__typeKeys[typeStr]["key"]
-            self.__dataSize += self.__typeKeys[typeStr]["size"]
-            if (item.values()[0] != "byte"):
-                self.__labels.append(item.keys()[0].encode('ascii'))
-
-        if self.__dataSize % 2:
-            raise DTSAnalyzerException('loadFrameDesc',
-                                       'Data size is not even')
+                self.__trigger = TriggerGate(self.__triggerExpr, self.__labels,
+                                             self.__dataSize,
+                                             self.__preTrigger,
+                                             self.__postTrigger)
+            except TriggerException as e:
+                raise DTSAnalyzerException(e.sender, e.msg)
 
     def __initLogFile(self):
+        if self.__binLog:
+            self.__logIO = FrameLogWriter(self.__logFile, {
+                'descriptor': self.__structDescFile,
+                'struct': self.__structDesc,
+                'format': self.__decoder,
+                'labels': self.__labels,
+                'dataSize': self.__dataSize})
+            return
         mode = 'a' if path.exists(self.__logFile) else 'w'
         self.__logIO = open(self.__logFile, mode, 1)
         if not isinstance(self.__logIO, file) or \
@@ -168,101 +190,156 @@ class DTSAnalyzer(object):
             self.__structDescFile + '\'\n')
         self.__logIO.write('Frame,' + ','.join(self.__labels) + '\n')
 
-    def __readBuffer(self):
-        while len(self.__buffer) < (self.__dataSize + len(self.__sof)):
-            buf = self.__d.read(256)
-            '''
-            buf = ''.join(self.__sof) + '\x10\x00\x10\x00\x20\x00\x00\x00'
-            buf += '\x00\x00\x80\x41\x00\x00\x00\x00\x00\x00\x40\x40'
-            sleep(.03)
-            '''
-            for c in buf:
-                if len(c):
-                    self.__buffer.append(c)
-
-    def __getSOF(self):
-        while (not self.__start):
-            if (self.__sofok >= len(self.__sof)):
-                if len(self.__buffer) < (self.__dataSize + len(self.__sof)):
-                    self.__readBuffer()
-                self.__sofok = 0
-                self.__start = 1
-                return
-
-            if (self.__start or len(self.__buffer) < 4):
-                self.__readBuffer()
-            if (self.__buffer.pop(0) == self.__sof[self.__sofok]):
-                self.__sofok += 1
-            else:
-                self.__sofok = 0
-
-    def __checkCRC(self, frame, size, crcIn):
-        crcOut = 0
-        c = 0
-        if len(frame[4:]) != self.__dataSize:
-            err = 'FATAL: Got ' + str(len(frame[4:])) + ' bytes instead of '
-            err += str(self.__dataSize) + '. Check JSON config file and/or FW!'
-            raise DTSAnalyzerException('decodeFrame', err)
-        for j in range(size):
-            crcOut ^= ord(frame[c]) << 8
-            for i in range(8):
-                if (crcOut & 0x8000):
-                    crcOut ^= (0x1070 << 3)
-                crcOut <<= 1
-            c += 1
-        return ((crcOut >> 8) == ord(crcIn))
-
-    def __decodeFrame(self, frame):
-        values = unpack(self.__decoder, frame)
-        return ([self.__labels, values])
-
-    def __printDataToTerm(self, data):
-        self.__out.write('| ')
-        for i in range(len(data[0])):
-            out = '{lC}[{l}]{lc}: {vC}{v:>19}{vc} | '.format(lC=lablColor,
-                                                             l=data[0][i],
-                                                             lc=normColor,
-                                                             vC=valuColor,
-                                                             v=data[1][i],
-                                                             vc=normColor)
-            self.__out.write(out)
-        if self.__displayFrameNb:
-            self.__out.write('{} '.format(self.__frameNb))
-        self.__out.write(self.__lineSep)
-
-    def __printDataToFile(self, data):
-        values = []
-
-        for v in data[1]:
-            values.append(str(v))
-        self.__logIO.write(str(self.__frameNb) + ',' + ','.join(values) + '\n')
+    def __onOverflow(self, dropped):
+        # The partial frame in the buffer cannot be completed anymore
+        self.__droppedBytes += dropped
+        self.__stats.overflows += 1
+        self.__stats.droppedBytes = self.__droppedBytes
+        self.__parser.clear()
+        self.__out.write('{nC}\n[Overflow] {d} bytes dropped ({t} total)\n'
+                         .format(nC=normColor, d=dropped,
+                                 t=self.__droppedBytes))
+
+    def __readBuffer(self, size):
+        stats = self.__stats
+        if self.__threaded:
+            # Device reads are recorded by the acquisition thread
+            queueWait = stats.histograms['queueWait']
+            while len(self.__parser) < size:
+                t = time()
+                buf = self.__d.read()
+                queueWait.add((time() - t) * 1e6)
+                self.__parser.feed(buf)
+            return
+        readSize = stats.histograms['readSize']
+        readLatency = stats.histograms['readLatency']
+        while len(self.__parser) < size:
+            t = time()
+            buf = self.__d.read()
+            readLatency.add((time() - t) * 1e6)
+            readSize.add(len(buf))
+            stats.reads += 1
+            stats.bytesRead += len(buf)
+            self.__parser.feed(buf)
+
+    def __updateStats(self):
+        stats = self.__stats
+        stats.frames = self.__parser.frameNb
+        stats.crcFailures = self.__parser.crcFailNb
+        stats.sofResyncs = self.__parser.resyncNb
+        stats.discardedBytes = self.__parser.discardedBytes
+        now = time()
+        periodic = self.__statsPeriod and \
+            now - self.__lastStats >= self.__statsPeriod
+        requested = stats.dumpRequested()
+        if not periodic and not requested:
+            return
+        self.__lastStats = now
+        stderr.write(stats.line() + '\n')
+        self.__dumpStats()
+
+    def __dumpStats(self):
+        if len(self.__statsFile):
+            self.__stats.resyncEvents = list(self.__parser.resyncs)
+            self.__stats.dumpJson(self.__statsFile)
+
+    def __onCrcError(self, crcFailNb, offset):
+        if not self.__crcBudget.add():
+            raise DTSAnalyzerException(
+                "run", "Too much CRC errors: {0} within {1:g} s (byte {2})"
+                .format(self.__crcBudget.count, self.__crcBudget.window,
+                        offset))
+
+    def __onResync(self, lost, found, reason):
+        if self.__dashboard or self.__noStdoutPrint:
+            return
+        self.__out.write('{nC}\n[Resync] bytes {l} to {f} skipped ({r})\n'
+                         .format(nC=normColor, l=lost, f=found, r=reason))
+
+    def __decodeFrames(self, payloads):
+        return self.__batchDecoder.decode(payloads)
+
+    def __decodeRows(self, payloads):
+        return self.__batchDecoder.rows(self.__decodeFrames(payloads))
+
+    def __applyTrigger(self, frameNbs, payloads, rows):
+        triggers = self.__trigger.triggers
+        frameNbs, payloads, rows = self.__trigger.select(
+            frameNbs, payloads, rows, self.__decodeRows)
+        if self.__trigger.triggers != triggers and not self.__dashboard and \
+                not self.__noStdoutPrint:
+            self.__out.write('{nC}\n[Trigger] frame {f} ({n} total)\n'
+                             .format(nC=normColor,
+                                     f=self.__trigger.lastTrigger,
+                                     n=self.__trigger.triggers))
+        return frameNbs, payloads, rows
+
+    def __printDataToTerm(self, frameNbs, rows):
+        termFormat = self.__desc.termFormat
+        lines = []
+        for frameNb, values in zip(frameNbs, rows):
+            lines.append(termFormat.format(*values))
+            if self.__displayFrameNb:
+                lines.append('{} '.format(frameNb))
+            lines.append(self.__lineSep)
+        self.__out.write(''.join(lines))
+
+    def __printDataToFile(self, frameNbs, rows):
+        csvFormat = self.__desc.csvFormat
+        self.__logIO.write(''.join([csvFormat.format(frameNb, *values)
+                                    for frameNb, values in zip(frameNbs,
+                                                               rows)]))
 
     def run(self):
-        crcFailNb = 0
-        while (1):
-            self.__readBuffer()
-            if not self.__start:
-                self.__getSOF()
-            c = 0
-            frame = "".join(self.__sof)
-            while (self.__start):
-                frame += self.__buffer.pop(0)
-                c += 1
-                if (c < self.__dataSize):
+        decodeTime = self.__stats.histograms['decodeTime']
+        sinkTime = self.__stats.histograms['sinkTime']
+        self.__stats.installSignal()
+        try:
+            while (1):
+                self.__readBuffer(self.__parser.frameSize)
+                frameNbs, payloads = self.__parser.frames()
+                self.__updateStats()
+                if not frameNbs:
                     continue
-                crc = self.__buffer.pop(0)
-                self.__frameNb += 1
-                self.__start = 0
-                if not self.__checkCRC(frame, len(frame), crc):
-                    crcFailNb += 1;
-                    if (crcFailNb >= 10):
-                        raise DTSAnalyzerException("run",
-                                                   "Too much CRC errors")
-                data = self.__decodeFrame(frame[4:])
-                if not self.__noStdoutPrint:
-                    self.__printDataToTerm(data)
-                if len(self.__logFile):
-                    self.__printDataToFile(data)
+                batch = rows = None
+                if self.__trigger:
+                    # Every frame is decoded to evaluate the trigger
+                    t = time()
+                    rows = self.__decodeRows(payloads)
+                    decodeTime.add((time() - t) * 1e6)
+                    frameNbs, payloads, rows = self.__applyTrigger(
+                        frameNbs, payloads, rows)
+                    if not frameNbs:
+                        continue
+                if self.__binLog:
+                    t = time()
+                    self.__logIO.write(frameNbs, payloads)
+                    sinkTime.add((time() - t) * 1e6)
+                    if self.__noStdoutPrint:
+                        continue
+                if rows is None:
+                    t = time()
+                    batch = self.__decodeFrames(payloads)
+                    rows = self.__batchDecoder.rows(batch)
+                    decodeTime.add((time() - t) * 1e6)
+                t2 = time()
+                if self.__dashboard:
+                    columns = self.__batchDecoder.columns(batch) \
+                        if batch is not None else \
+                        dict(zip(self.__labels, zip(*rows)))
+                    self.__dashboard.update(columns, rows[-1],
+                                            self.__parser.frameNb,
+                                            self.__parser.crcFailNb)
+                elif not self.__noStdoutPrint:
+                    self.__printDataToTerm(frameNbs, rows)
+                if len(self.__logFile) and not self.__binLog:
+                    self.__printDataToFile(frameNbs, rows)
+                sinkTime.add((time() - t2) * 1e6)
+        finally:
+            if self.__dashboard:
+                self.__dashboard.draw()
+            self.__out.flush()
+            self.__dumpStats()
 
 
 def main():
@@ -282,6 +359,12 @@ def main():
                    metavar='FILE',
                    help='Log file output: Print log into FILE')
 
+    p.add_argument('--log-format',
+                   choices=['csv', 'bin'],
+                   default='csv',
+                   help='Log file format (convert bin logs with \
+                       DTSLogConvert.py)')
+
     p.add_argument('--no-stdout',
                    default=False,
                    action='store_true',
@@ -297,8 +380,81 @@ def main():
                    action='store_true',
                    help='Multi-line monitoring')
 
+    p.add_argument('--dashboard', '-D',
+                   type=float,
+                   nargs='?',
+                   const=20.,
+                   default=0.,
+                   metavar='HZ',
+                   help='Dashboard mode: redraw latest values and running \
+                       statistics at most HZ times per second (default 20)')
+
+    p.add_argument('--trigger', '-T',
+                   type=str,
+                   default='',
+                   metavar='EXPR',
+                   help='Only print and log the frames around the ones \
+                       matching EXPR, a Python expression over the \
+                       descriptor labels (e.g. "current > 500 or \
+                       abs(pos - prev_pos) > 100")')
+
+    p.add_argument('--pre-trigger',
+                   type=int,
+                   default=100,
+                   metavar='N',
+                   help='Frames kept before every trigger (with --trigger)')
+
+    p.add_argument('--post-trigger',
+                   type=int,
+                   default=100,
+                   metavar='N',
+                   help='Frames kept after every trigger (with --trigger)')
+
+    p.add_argument('--crc-budget',
+                   type=int,
+                   default=10,
+                   metavar='N',
+                   help='Abort after N CRC errors within the --crc-window \
+                       (0: never abort)')
+
+    p.add_argument('--crc-window',
+                   type=float,
+                   default=1.,
+                   metavar='SECONDS',
+                   help='Sliding window of the CRC error budget')
+
+    p.add_argument('--threaded', '-t',
+                   default=False,
+                   action='store_true',
+                   help='Read the device from a dedicated acquisition thread')
+
+    p.add_argument('--queue-size',
+                   type=int,
+                   default=1024,
+                   metavar='N',
+                   help='Acquisition queue length in chunks (with --threaded)')
+
+    p.add_argument('--stats',
+                   type=float,
+                   nargs='?',
+                   const=1.,
+                   default=0.,
+                   metavar='SECONDS',
+                   help='Print pipeline statistics on stderr every SECONDS \
+                       (default 1). Statistics are also printed on SIGUSR1')
+
+    p.add_argument('--stats-file',
+                   type=str,
+                   default='',
+                   metavar='FILE',
+                   help='Dump pipeline statistics as JSON into FILE')
+
+    addOutputArguments(p)
+    addSourceArguments(p)
+
     args = p.parse_args()
 
+    dtsAnalyzer = None
     try:
         dtsAnalyzer = DTSAnalyzer(args)
         dtsAnalyzer.run()
@@ -306,8 +462,12 @@ def main():
         print normColor + 'FTDI Exception caught : ' + e.args[0]
     except DTSAnalyzerException as e:
         print normColor + '[{0}] : {1}'.format(e.sender, e.msg)
+    except EOFError:
+        print normColor + '\nEnd of replayed stream'
     except KeyboardInterrupt:
         pass
+    if dtsAnalyzer:
+        dtsAnalyzer.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Hardware-free benchmark of the DTS analysis pipeline.
+
+Synthetic streams are generated for every struct descriptor and every error
+rate, then each stage is timed separately: SOF synchronization, CRC check,
+the whole frame parser, batch decoding and the terminal, CSV and binary log
+sinks. Results are printed as frames/s and bytes/s and can be saved as JSON
+to compare runs.
+"""
+from lib.Descriptor import compileDescriptor
+from lib.FrameGenerator import FrameGenerator
+from lib.FrameParser import FrameParser, SOF
+from lib.FrameDecoder import BatchDecoder
+from lib.FrameLog import FrameLogWriter
+from lib.ByteRing import ByteRing
+from lib.CRC import CRC8
+from tempfile import mkstemp
+from time import time
+from glob import glob
+from os import close, remove, devnull
+import argparse
+import json
+
+
+def chunked(stream, size):
+    return [stream[i:i + size] for i in xrange(0, len(stream), size)]
+
+
+def benchSync(chunks, frameSize):
+    ring = ByteRing()
+    keep = len(SOF) - 1
+    offsets = []
+    for chunk in chunks:
+        ring.write(chunk)
+        while True:
+            idx = ring.find(SOF)
+            if idx < 0:
+                ring.consume(max(0, len(ring) - keep))
+                break
+            ring.consume(idx)
+            if len(ring) < frameSize:
+                break
+            offsets.append(ring.consumed)
+            ring.consume(frameSize)
+    return offsets
+
+
+def benchParser(chunks, dataSize):
+    parser = FrameParser(dataSize)
+    frameNbs, payloads = [], bytearray()
+    for chunk in chunks:
+        parser.feed(chunk)
+        nbs, p = parser.frames()
+        frameNbs.extend(nbs)
+        payloads += p
+    return frameNbs, payloads
+
+
+def timed(fn, repeat):
+    best = None
+    for r in range(repeat):
+        t = time()
+        result = fn()
+        t = time() - t
+        best = t if best is None or t < best else best
+    return best, result
+
+
+def runCase(desc, frames, noise, chunkSize, repeat, seed):
+    gen = FrameGenerator(desc, seed)
+    stream = gen.stream(frames, noise=noise, truncate=noise / 2,
+                        crcError=noise / 2)
+    chunks = chunked(stream, chunkSize)
+    frameSize = gen.frameSize
+    decoder = BatchDecoder(desc.format, desc.labels)
+    results = {}
+
+    t, offsets = timed(lambda: benchSync(chunks, frameSize), repeat)
+    results['sync'] = (t, len(offsets))
+
+    buf = bytearray(stream)
+    t, ok = timed(lambda: CRC8.checkBatch(buf, offsets, frameSize - 1),
+                  repeat)
+    results['crc'] = (t, len(ok))
+
+    t, (frameNbs, payloads) = timed(lambda: benchParser(chunks,
+                                                        desc.dataSize),
+                                    repeat)
+    results['parser'] = (t, len(frameNbs))
+
+    t, batch = timed(lambda: decoder.rows(decoder.decode(payloads)), repeat)
+    results['decode'] = (t, len(batch))
+    rows = batch
+
+    null = open(devnull, 'w')
+
+    def termSink():
+        null.write(''.join([desc.termFormat.format(*values) + '\r'
+                            for values in rows]))
+
+    def csvSink():
+        null.write(''.join([desc.csvFormat.format(nb, *values)
+                            for nb, values in zip(frameNbs, rows)]))
+
+    fd, binPath = mkstemp(suffix='.dtslog')
+    close(fd)
+
+    def binSink():
+        log = FrameLogWriter(binPath, {'descriptor': desc.descFile,
+                                       'struct': desc.desc,
+                                       'format': desc.format,
+                                       'labels': desc.labels,
+                                       'dataSize': desc.dataSize})
+        log.write(frameNbs, payloads)
+        log.close()
+
+    for name, fn in (('term', termSink), ('csv', csvSink), ('bin', binSink)):
+        t, r = timed(fn, repeat)
+        results[name] = (t, len(frameNbs))
+    null.close()
+    remove(binPath)
+
+    return {'descriptor': desc.descFile, 'frameSize': frameSize,
+            'noise': noise, 'streamBytes': len(stream),
+            'crcErrors': gen.crcErrors, 'truncated': gen.truncated,
+            'stages': dict((name, {'seconds': t, 'frames': n,
+                                   'framesPerSecond': n / t if t else 0,
+                                   'bytesPerSecond': len(stream) / t
+                                   if t else 0})
+                           for name, (t, n) in results.items())}
+
+
+STAGES = ('sync', 'crc', 'parser', 'decode', 'term', 'csv', 'bin')
+
+
+def printCase(case):
+    print '{0} ({1} bytes/frame, error rate {2})'.format(
+        case['descriptor'], case['frameSize'], case['noise'])
+    for name in STAGES:
+        s = case['stages'][name]
+        print '  {0:<8} {1:>12.0f} frames/s {2:>12.2f} MB/s'.format(
+            name, s['framesPerSecond'], s['bytesPerSecond'] / 1e6)
+
+
+def main():
+    p = argparse.ArgumentParser(prog='DTSBenchmark.py',
+                                description='Benchmark the DTS pipeline \
+                                    on synthetic frames.')
+    p.add_argument('--desc', '-d',
+                   type=str,
+                   action='append',
+                   metavar='FILE',
+                   help='Struct descriptor to benchmark (repeatable, \
+                       default: descriptor-examples/*.json)')
+
+    p.add_argument('--frames', '-f',
+                   type=int,
+                   default=20000,
+                   metavar='N',
+                   help='Number of frames per stream')
+
+    p.add_argument('--error-rate', '-e',
+                   type=float,
+                   action='append',
+                   metavar='P',
+                   help='Probability of noise before a frame; half of it \
+                       is used for truncated frames and CRC errors \
+                       (repeatable, default: 0 0.01 0.1)')
+
+    p.add_argument('--chunk-size',
+                   type=int,
+                   default=256,
+                   metavar='BYTES',
+                   help='Size of the simulated device reads')
+
+    p.add_argument('--repeat', '-r',
+                   type=int,
+                   default=3,
+                   metavar='N',
+                   help='Keep the best of N runs')
+
+    p.add_argument('--seed',
+                   type=int,
+                   default=0,
+                   help='Random generator seed')
+
+    p.add_argument('--output', '-o',
+                   type=str,
+                   default='',
+                   metavar='FILE',
+                   help='Save the results as JSON into FILE')
+
+    a = p.parse_args()
+
+    descs = a.desc or sorted(glob('descriptor-examples/*.json'))
+    rates = a.error_rate or [0., .01, .1]
+    cases = []
+    for descFile in descs:
+        desc = compileDescriptor(descFile)
+        for rate in rates:
+            case = runCase(desc, a.frames, rate, a.chunk_size, a.repeat,
+                           a.seed)
+            printCase(case)
+            cases.append(case)
+
+    if len(a.output):
+        with open(a.output, 'w') as f:
+            json.dump(cases, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Offline analysis of DTS CSV logs (DTSAnalyzer --log).
+
+The log is streamed in one pass through a memory map, whatever its size.
+It is split into sessions at their '#' headers. Each session gets per-label
+statistics and, on request, a min/max envelope decimated to a bounded
+number of points. The pass also writes a sidecar frame index (LOG.idx),
+so that frame ranges can later be extracted without rescanning the log.
+"""
+from lib.CSVLog import CSVLogReader, CSVLogException, loadIndex, \
+    saveIndex, seekOffset
+from lib.Stats import RunningStats, MinMaxEnvelope
+from sys import stdout
+import argparse
+
+
+def isNumeric(row):
+    try:
+        for v in row[1:]:
+            float(v)
+    except ValueError:
+        return False
+    return True
+
+
+class SessionAnalysis(object):
+    def __init__(self, info, points):
+        self.info = info
+        self.labels = info['columns'][1:]
+        self.stats = [RunningStats() for l in self.labels]
+        self.envelopes = [MinMaxEnvelope(points) for l in self.labels] \
+            if points else None
+
+    def update(self, rows):
+        try:
+            columns = [[float(v) for v in column]
+                       for column in zip(*rows)[1:]]
+        except ValueError:
+            # Corrupted rows are rare, only then check every row
+            rows = [row for row in rows if isNumeric(row)]
+            if not rows:
+                return
+            columns = [[float(v) for v in column]
+                       for column in zip(*rows)[1:]]
+        frameNbs = [int(row[0]) for row in rows]
+        for i, values in enumerate(columns):
+            self.stats[i].updateBatch(values)
+            if self.envelopes:
+                update = self.envelopes[i].update
+                for frameNb, v in zip(frameNbs, values):
+                    update(frameNb, v)
+
+
+def analyze(reader, points, stride):
+    sessions = []
+
+    def onSession(info):
+        sessions.append(SessionAnalysis(info, points))
+
+    def onRows(rows):
+        sessions[-1].update(rows)
+
+    index = reader.buildIndex(stride, onRows, onSession)
+    return index, sessions
+
+
+def printSummary(index, sessions):
+    for n, (s, a) in enumerate(zip(index['sessions'], sessions)):
+        print '[Session {0}] {1}'.format(n, s['descriptor'] or '?')
+        print '  {0} frames, #{1} to #{2}'.format(s['frames'], s['first'],
+                                                  s['last'])
+        for label, st in zip(a.labels, a.stats):
+            print '  {0:<16} mean={1:<12g} std={2:<12g} min={3:<12g} ' \
+                'max={4:g}'.format(label, st.mean, st.stddev,
+                                   st.min if st.count else 0,
+                                   st.max if st.count else 0)
+
+
+def writeEnvelopes(out, sessions):
+    for n, a in enumerate(sessions):
+        out.write('# Session {0}, {1} frames per point\n'.format(
+            n, a.envelopes[0].width if a.envelopes else 1))
+        out.write('Frame,' + ','.join(l + '_min,' + l + '_max'
+                                      for l in a.labels) + '\n')
+        if not a.labels:
+            continue
+        buckets = zip(*[e.buckets for e in a.envelopes])
+        out.write(''.join([
+            str(b[0][0]) + ',' + ','.join('{0:g},{1:g}'.format(lo, hi)
+                                          for key, lo, hi in b) + '\n'
+            for b in buckets]))
+
+
+def extract(reader, index, out, start, end, session=None):
+    first = True
+    for n, s in enumerate(index['sessions']):
+        if session is not None and n != session:
+            continue
+        if not s['frames'] or (end is not None and s['first'] > end) or \
+                (start is not None and s['last'] < start):
+            continue
+        if not first:
+            out.write('\n\n\n' + '#' * 79 + '\n')
+        first = False
+        out.write('# Log generated with DTS logger and using struct '
+                  'descriptor: \'' + s['descriptor'] + '\'\n')
+        out.write(','.join(s['columns']) + '\n')
+        offset = seekOffset(s, start) if start is not None else \
+            s['index'][0][1]
+        lines = []
+        for row in reader.rowsFrom(offset, end, len(s['columns'])):
+            if start is not None and int(row[0]) < start:
+                continue
+            lines.append(','.join(row) + '\n')
+            if len(lines) >= 4096:
+                out.write(''.join(lines))
+                lines = []
+        out.write(''.join(lines))
+
+
+def main():
+    p = argparse.ArgumentParser(prog='DTSLogAnalyze.py',
+                                description='Analyze DTS CSV logs.')
+    p.add_argument('log',
+                   type=str,
+                   metavar='LOG',
+                   help='CSV log file')
+
+    p.add_argument('--envelope', '-e',
+                   type=str,
+                   default='',
+                   metavar='FILE',
+                   help='Save the min/max envelope of every label as CSV \
+                       into FILE')
+
+    p.add_argument('--points',
+                   type=int,
+                   default=1000,
+                   metavar='N',
+                   help='Maximum number of envelope points per session')
+
+    p.add_argument('--start',
+                   type=int,
+                   default=None,
+                   metavar='N',
+                   help='Extract from frame number N (uses the index)')
+
+    p.add_argument('--end',
+                   type=int,
+                   default=None,
+                   metavar='N',
+                   help='Extract up to frame number N (uses the index)')
+
+    p.add_argument('--session',
+                   type=int,
+                   default=None,
+                   metavar='N',
+                   help='Only extract from session N')
+
+    p.add_argument('--output', '-o',
+                   type=str,
+                   default='',
+                   metavar='FILE',
+                   help='Extracted CSV output file (default: stdout)')
+
+    p.add_argument('--stride',
+                   type=int,
+                   default=1024,
+                   metavar='N',
+                   help='Index every N-th row')
+
+    args = p.parse_args()
+
+    extracting = args.start is not None or args.end is not None or \
+        args.session is not None
+    try:
+        reader = CSVLogReader(args.log)
+    except IOError as e:
+        print 'Log error : ' + str(e)
+        return
+    try:
+        index = loadIndex(args.log) \
+            if extracting and not len(args.envelope) else None
+        if index is None:
+            points = args.points if len(args.envelope) else 0
+            index, sessions = analyze(reader, points, args.stride)
+            saveIndex(args.log, index)
+            if not extracting:
+                printSummary(index, sessions)
+            if len(args.envelope):
+                with open(args.envelope, 'w') as f:
+                    writeEnvelopes(f, sessions)
+        if extracting:
+            out = open(args.output, 'w') if len(args.output) else stdout
+            extract(reader, index, out, args.start, args.end, args.session)
+            if out is not stdout:
+                out.close()
+    except CSVLogException as e:
+        print 'Log error : ' + e.args[0]
+    finally:
+        reader.close()
+
+
+if __name__ == "__main__":
+    main()
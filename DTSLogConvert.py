@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Convert a binary DTS frame log (DTSAnalyzer --log-format bin) to the CSV
+layout written by DTSAnalyzer (Frame,<labels>). The log is streamed chunk
+by chunk, so the memory use does not depend on the log size. A frame range
+is read from the chunk holding its first frame, found with the sparse
+index of every session.
+"""
+from lib.FrameLog import FrameLogReader, FrameLogException, seekIndex
+from lib.FrameDecoder import BatchDecoder
+from sys import stdout
+import argparse
+
+
+def writeSessionHeader(out, meta, first):
+    if not first:
+        out.write('\n\n\n' + '#' * 79 + '\n')
+    out.write('# Log generated with DTS logger and using struct descriptor: \'' +
+              meta['descriptor'] + '\'\n')
+    out.write('Frame,' + ','.join(meta['labels']) + '\n')
+
+
+def convert(reader, out, start=None, end=None):
+    first = True
+    for meta, index, _ in reader.sessions():
+        writeSessionHeader(out, meta, first)
+        first = False
+        if not index:
+            continue
+        decoder = BatchDecoder(meta['format'], meta['labels'])
+        chunkOffset = seekIndex(index, start) if start is not None else \
+            index[0][2]
+        for kind, item in reader.chunks(chunkOffset, end):
+            if kind == 'session':
+                break
+            convertChunk(out, decoder, item, start, end)
+
+
+def convertChunk(out, decoder, chunk, start, end):
+    ts, frameNbs, payloads = chunk
+    if start is not None and frameNbs[-1] < start:
+        return
+    lines = []
+    for frameNb, values in zip(frameNbs,
+                               decoder.rows(decoder.decode(payloads))):
+        if (start is not None and frameNb < start) or \
+                (end is not None and frameNb > end):
+            continue
+        lines.append(str(frameNb) + ',' + ','.join(map(str, values)) +
+                     '\n')
+    out.write(''.join(lines))
+
+
+def main():
+    p = argparse.ArgumentParser(prog='DTSLogConvert.py',
+                                description='Convert binary DTS logs to CSV.')
+    p.add_argument('log',
+                   type=str,
+                   metavar='LOG',
+                   help='Binary log file')
+
+    p.add_argument('--output', '-o',
+                   type=str,
+                   default='',
+                   metavar='FILE',
+                   help='CSV output file (default: stdout)')
+
+    p.add_argument('--start',
+                   type=int,
+                   default=None,
+                   metavar='N',
+                   help='First frame number to convert')
+
+    p.add_argument('--end',
+                   type=int,
+                   default=None,
+                   metavar='N',
+                   help='Last frame number to convert')
+
+    p.add_argument('--index',
+                   default=False,
+                   action='store_true',
+                   help='Print the sparse index of every session and exit')
+
+    args = p.parse_args()
+
+    reader = FrameLogReader(args.log)
+    try:
+        if args.index:
+            for meta, index, _ in reader.sessions():
+                print '# ' + meta['descriptor']
+                for first, ts, offset in index:
+                    print '{0},{1:.6f},{2}'.format(first, ts, offset)
+            return
+        out = open(args.output, 'w') if len(args.output) else stdout
+        convert(reader, out, args.start, args.end)
+        if out is not stdout:
+            out.close()
+    except FrameLogException as e:
+        print 'Log error : ' + e.args[0]
+    finally:
+        reader.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Capture DTS frames from several FTDI devices at once.
+
+Every device runs in its own acquisition process, with its own struct
+descriptor and CSV log. Log timestamps are taken on the system wide
+monotonic clock, relative to a time base shared by all the processes, so
+the logs of the different buses can be aligned. The parent process merges
+the status of every capture into a single display.
+"""
+from lib.Output import CoalescingStreamWrapper
+from lib.ByteSource import FtdiError, openSource
+from lib.Descriptor import compileDescriptor, DescriptorException
+from lib.FrameParser import FrameParser
+from lib.FrameDecoder import BatchDecoder
+from lib.Clock import monotonic
+from multiprocessing import Process, Queue, Event
+from Queue import Empty
+from argparse import Namespace
+from sys import stdout
+from os import system, path
+import argparse
+
+normColor = '\x1b[0;0m'
+lablColor = '\x1b[33m'
+valuColor = '\x1b[1;37m'
+home = '\x1b[H'
+clearEol = '\x1b[K'
+
+
+def parseDeviceSpec(spec):
+    fields = spec.split(',')
+    if len(fields) != 3 or not all(len(f) for f in fields):
+        raise argparse.ArgumentTypeError('expected SERIAL,DESC,LOG, got \'' +
+                                         spec + '\'')
+    return tuple(fields)
+
+
+def openLog(logFile, serial, descFile, labels, timeBase):
+    mode = 'a' if path.exists(logFile) else 'w'
+    logIO = open(logFile, mode)
+    if mode == 'a':
+        logIO.write('\n\n\n' + '#' * 79 + '\n')
+    logIO.write('# Log generated with DTS multi capture on device \'' +
+                serial + '\' and using struct descriptor: \'' + descFile +
+                '\'\n')
+    logIO.write('# Time: seconds on CLOCK_MONOTONIC since ' +
+                repr(timeBase) + '\n')
+    logIO.write('Frame,Time,' + ','.join(labels) + '\n')
+    return logIO
+
+
+def captureWorker(serial, descFile, logFile, timeBase, status, stop,
+                  statusPeriod=.25):
+    state = {'serial': serial, 'frames': 0, 'crcErrors': 0, 'bytes': 0,
+             'latest': None, 'labels': [], 'state': 'starting'}
+    source = logIO = None
+    try:
+        desc = compileDescriptor(descFile)
+        state['labels'] = desc.labels
+        if serial.startswith('file:'):
+            a = Namespace(replay=serial[len('file:'):])
+        else:
+            a = Namespace(serial=serial)
+        source = openSource(a)
+        parser = FrameParser(desc.dataSize)
+        decoder = BatchDecoder(desc.format, desc.labels)
+        logIO = openLog(logFile, serial, descFile, desc.labels, timeBase)
+        csvFormat = '{0},{1:.6f},' + ','.join(
+            '{' + str(i + 2) + '}' for i in range(len(desc.labels))) + '\n'
+        state['state'] = 'running'
+        lastStatus = 0
+        while not stop.is_set():
+            data = source.read(4096)
+            if not len(data):
+                continue
+            ts = monotonic() - timeBase
+            state['bytes'] += len(data)
+            parser.feed(data)
+            frameNbs, payloads = parser.frames()
+            if frameNbs:
+                rows = decoder.rows(decoder.decode(payloads))
+                logIO.write(''.join([csvFormat.format(nb, ts, *values)
+                                     for nb, values in zip(frameNbs, rows)]))
+                state['latest'] = rows[-1]
+            state['frames'] = parser.frameNb
+            state['crcErrors'] = parser.crcFailNb
+            if ts - lastStatus >= statusPeriod:
+                lastStatus = ts
+                status.put(dict(state, time=ts))
+        state['state'] = 'stopped'
+    except EOFError:
+        state['state'] = 'end of stream'
+    except KeyboardInterrupt:
+        state['state'] = 'stopped'
+    except FtdiError as e:
+        state['state'] = 'FTDI error: ' + e.args[0]
+    except DescriptorException as e:
+        state['state'] = '[{0}] : {1}'.format(e.sender, e.msg)
+    except (IOError, OSError) as e:
+        state['state'] = 'error: ' + str(e)
+    finally:
+        if logIO:
+            logIO.close()
+        if source:
+            source.close()
+        status.put(dict(state, time=monotonic() - timeBase, done=True))
+
+
+class MultiCapture(object):
+    def __init__(self, devices, rate=4.):
+        self._devices = devices
+        self._period = 1. / rate
+        self._out = CoalescingStreamWrapper(stdout)
+        self._status = Queue()
+        self._stop = Event()
+        self._timeBase = monotonic()
+        self._states = dict((serial, {'state': 'starting'})
+                            for serial, desc, log in devices)
+        self._procs = [Process(target=captureWorker,
+                               args=(serial, desc, log, self._timeBase,
+                                     self._status, self._stop))
+                       for serial, desc, log in devices]
+
+    def _draw(self):
+        lines = [home + 'DTS multi capture : {0} device(s)  t={1:.1f} s'
+                 .format(len(self._devices), monotonic() - self._timeBase) +
+                 clearEol]
+        for serial, desc, log in self._devices:
+            s = self._states[serial]
+            lines.append(('{lC}[{serial}]{nC} {state}  frames={f}  '
+                          'CRC errors={c}  bytes={b}  -> {log}' +
+                          clearEol).format(
+                lC=lablColor, nC=normColor, serial=serial,
+                state=s['state'], f=s.get('frames', 0),
+                c=s.get('crcErrors', 0), b=s.get('bytes', 0), log=log))
+            if s.get('latest') is not None:
+                lines.append('  ' + ' '.join(
+                    '{0}={vC}{1}{nC}'.format(l, v, vC=valuColor,
+                                             nC=normColor)
+                    for l, v in zip(s['labels'], s['latest'])) + clearEol)
+            else:
+                lines.append(clearEol)
+        self._out.write('\n'.join(lines) + '\n')
+
+    def run(self):
+        system('clear')
+        for p in self._procs:
+            p.start()
+        running = len(self._procs)
+        try:
+            while running:
+                try:
+                    s = self._status.get(True, self._period)
+                    self._states[s['serial']] = s
+                    if s.get('done'):
+                        running -= 1
+                except Empty:
+                    pass
+                self._draw()
+        finally:
+            self._stop.set()
+            for p in self._procs:
+                p.join(2.)
+            while True:
+                try:
+                    s = self._status.get_nowait()
+                    self._states[s['serial']] = s
+                except Empty:
+                    break
+            self._draw()
+            self._out.close()
+
+
+def main():
+    descStr = 'Capture DTS frames from several FTDI devices in parallel.'
+    p = argparse.ArgumentParser(prog='DTSMultiCapture.py',
+                                description=descStr)
+    p.add_argument('--device', '-x',
+                   type=parseDeviceSpec,
+                   action='append',
+                   required=True,
+                   metavar='SERIAL,DESC,LOG',
+                   help='Capture device SERIAL decoded with struct \
+                       descriptor DESC into CSV log LOG (repeat for every \
+                       device; use file:PATH as SERIAL to replay a capture)')
+
+    p.add_argument('--rate',
+                   type=float,
+                   default=4.,
+                   metavar='HZ',
+                   help='Status display refresh rate')
+
+    args = p.parse_args()
+
+    serials = [d[0] for d in args.device]
+    if len(set(serials)) != len(serials):
+        p.error('every device can only be captured once')
+
+    try:
+        MultiCapture(args.device, args.rate).run()
+    except KeyboardInterrupt:
+        pass
+    print normColor + '\nExiting multi capture'
+
+
+if __name__ == "__main__":
+    main()
@@ -9,10 +9,16 @@ Author: Samir Ahamada
 Contact: sahamada@aldebaran.com
 """
 
-from lib.Output import UnbufferedStreamWrapper
-from lib.Output import Hexdump
-from pylibftdi import Device
-from pylibftdi import FtdiError
+from lib.Output import openOutput, addOutputArguments
+from lib.Output import Hexdump, rawHex
+from lib.ByteSource import FtdiError, openSource, addSourceArguments
+from lib.Acquisition import ThreadedSource
+from lib.RingCapture import RingCapture, isRingFile
+from lib.FanOut import FanOut, makeSink
+from lib.Callback import weakMethod
+from binascii import hexlify, unhexlify
+from time import time
+import signal
 from sys import stdout
 from os import system, path
 import abc
@@ -25,11 +31,11 @@ valuColor = '\x1b[1;37m'
 
 class RS485MonitorException(Exception):
     def __init__(self, sender, msg):
-        self.__sender = sender
-        self.__msg = msg
+        self.sender = sender
+        self.msg = msg
 
     def __str__(self):
-        return repr(self.__msg)
+        return repr(self.msg)
 
 
 class RS485Monitor(object):
@@ -37,22 +43,47 @@ class RS485Monitor(object):
 
     def __init__(self, a, mode='t', baudrate=1250000,
                  databits=8, stopbits=0, paritymode=2):
+        self._closed = False
         self._single = a.single
         self._count = 0
-        self._out = UnbufferedStreamWrapper(stdout)
-
+        self._out = None
+        self._d = None
         try:
-            self._d = Device()
-            self._d.baudrate = baudrate
-            self._d.ftdi_fn.ftdi_set_line_property(databits,
-                                                   stopbits,
-                                                   paritymode)
-            self._d.flush()
-        except FtdiError as e:
-            self._d = None
-            raise FtdiError('could not start FTDI Device "' + e.args[0] + '"')
+            self._out = openOutput(a, stdout)
+            self._d = openSource(a, baudrate, databits, stopbits, paritymode)
+            if a.threaded:
+                # Recording happens in the acquisition thread
+                self._d = ThreadedSource(
+                    self._d, a.queue_size, None,
+                    onOverflow=weakMethod(self._onOverflow))
+            self._setup(a)
+        except:
+            # Don't leave the device open behind a failed construction
+            self.close()
+            raise
+
+    def _setup(self, a):
+        '''Mode specific initialization, once the device is open'''
+        pass
+
+    def _onOverflow(self, dropped):
+        self._out.write('{nC}\n[Overflow] {d} bytes dropped\n'.format(
+            nC=normColor, d=dropped))
 
     def __del__(self):
+        self.close()
+
+    def close(self):
+        # Callbacks are weak methods, so that __del__ runs as soon as the
+        # monitor is dropped; main() still closes it explicitly on exit
+        if self._closed:
+            return
+        self._closed = True
+        if self._out:
+            self._out.close()
+        if getattr(self._out, 'droppedBytes', 0):
+            print normColor + '\n{0} bytes of output dropped'.format(
+                self._out.droppedBytes)
         try:
             if self._d:
                 self._d.flush()
@@ -77,18 +108,24 @@ class MonitorNormal(RS485Monitor):
                           ' [Normal mode]')
 
         while (1):
-            buf = self._d.read(256)
+            buf = self._d.read()
             self._out.write(buf)
             if (self._single and len(buf)):
-                self.__count += 1
-            if (self._single and (self.__count >= self._single)):
+                self._count += 1
+            if (self._single and (self._count >= self._single)):
                 raise KeyboardInterrupt
 
 
 class MonitorHexdump(RS485Monitor):
-    def __init__(self, a, *args, **kwargs):
-        super(MonitorHexdump, self).__init__(a, *args, **kwargs)
-        self.__hexdump = Hexdump()
+    __hexdump = None
+
+    def _setup(self, a):
+        self.__hexdump = Hexdump(self._out)
+
+    def close(self):
+        if self.__hexdump and not self._closed:
+            self.__hexdump.flush()
+        super(MonitorHexdump, self).close()
 
     def run(self):
         system('clear')
@@ -97,17 +134,22 @@ class MonitorHexdump(RS485Monitor):
                           ' [Hexdump mode]')
 
         while (1):
-            buf = self._d.read(256)
-            self.__hexdump.write(buf)
+            buf = self._d.read()
+            if len(buf):
+                self.__hexdump.write(buf)
+            else:
+                # Line idle, show the end of the burst
+                self.__hexdump.flush()
             if (self._single and len(buf)):
-                self.__count += 1
-            if (self._single and (self.__count >= self._single)):
+                self._count += 1
+            if (self._single and (self._count >= self._single)):
                 raise KeyboardInterrupt
 
 
 class MonitorRaw(RS485Monitor):
-    def __init__(self, a, *args, **kwargs):
-        super(MonitorRaw, self).__init__(a, *args, **kwargs)
+    def _setup(self, a):
+        self.__group = a.group
+        self.__noStdout = a.no_stdout
 
     def run(self):
         system('clear')
@@ -115,27 +157,138 @@ class MonitorRaw(RS485Monitor):
         self._out.writeln('Baudrate=' + str(self._d.baudrate) + ' [Raw mode]')
 
         while (1):
-            buf = self._d.read(2)
-            if len(buf):
-                for c in buf:
-                    self._out.write(format(ord(c), 'x'))
-                self._out.write(':')
+            buf = self._d.read()
+            if len(buf) and not self.__noStdout:
+                self._out.write(rawHex(buf, self.__group))
             if (self._single and len(buf)):
-                self.__count += 1
-            if (self._single and (self.__count >= self._single)):
+                self._count += 1
+            if (self._single and (self._count >= self._single)):
                 raise KeyboardInterrupt
 
 
+class MonitorRing(RS485Monitor):
+    __ring = None
+
+    def _setup(self, a):
+        if not len(a.ring):
+            raise RS485MonitorException('ring', 'No ring file given (--ring)')
+        if isRingFile(a.ring) and not a.force:
+            ring = RingCapture(a.ring)
+            frozen = ring.frozen
+            ring.close()
+            if frozen:
+                raise RS485MonitorException(
+                    'ring', '\'' + a.ring + '\' holds a frozen capture, ' +
+                    'extract it with RingExtract.py or use --force')
+        try:
+            self.__trigger = unhexlify(a.trigger.replace(' ', ''))
+        except TypeError:
+            raise RS485MonitorException('ring', 'Trigger must be hexadecimal')
+        self.__postTrigger = a.post_trigger * 1024
+        self.__signaled = False
+        self.__ring = RingCapture(a.ring, a.ring_size * 1024 * 1024,
+                                  self._d.baudrate)
+        self.__ringFile = a.ring
+        signal.signal(signal.SIGUSR1, weakMethod(self.__onSignal))
+
+    def close(self):
+        if self.__ring:
+            self.__ring.close()
+            self.__ring = None
+        super(MonitorRing, self).close()
+
+    def __onSignal(self, signum, frame):
+        self.__signaled = True
+
+    def run(self):
+        system('clear')
+        self._out.write('Monitor started : ')
+        self._out.writeln('Baudrate=' + str(self._d.baudrate) +
+                          ' [Ring capture mode]')
+        self._out.writeln('Ring file \'{0}\': {1} bytes, trigger: {2}'.format(
+            self.__ringFile, self.__ring.capacity,
+            hexlify(self.__trigger) if self.__trigger else 'SIGUSR1 only'))
+
+        keep = len(self.__trigger) - 1
+        tail = ''
+        triggerTime = None
+        remaining = 0
+        lastStatus = 0
+        while (1):
+            buf = self._d.read()
+            now = time()
+            if len(buf):
+                self.__ring.write(buf, now)
+            if triggerTime is None:
+                if self.__trigger and len(buf):
+                    data = tail + buf
+                    if data.find(self.__trigger) >= 0:
+                        self.__signaled = True
+                    tail = data[-keep:] if keep else ''
+                if self.__signaled:
+                    triggerTime = now
+                    remaining = self.__postTrigger
+                    self._out.writeln('\nTriggered, capturing {0} more '
+                                      'bytes'.format(remaining))
+            else:
+                remaining -= len(buf)
+            if triggerTime is not None and remaining <= 0:
+                self.__ring.freeze(triggerTime)
+                self._out.writeln('\nRing frozen, extract it with ' +
+                                  'RingExtract.py ' + self.__ringFile)
+                raise KeyboardInterrupt
+            if now - lastStatus >= 1:
+                lastStatus = now
+                self._out.write('\r{0} bytes captured, {1} chunks in ring'
+                                .format(self.__ring.totalBytes,
+                                        self.__ring.records))
+
+
+class MonitorFanOut(RS485Monitor):
+    __fanOut = None
+
+    def _setup(self, a):
+        if not a.sink:
+            raise RS485MonitorException('fanout', 'No sink given (--sink)')
+        sinks = []
+        try:
+            for spec in a.sink:
+                sinks.append(makeSink(spec, self._out, self._d.baudrate))
+        except ValueError as e:
+            for sink in sinks:
+                sink.close()
+            raise RS485MonitorException('fanout', str(e))
+        self.__fanOut = FanOut(self._d, sinks, None, a.queue_size)
+
+    def close(self):
+        if self.__fanOut and not self._closed:
+            # After the output still pending in self._out
+            self._out.flush()
+            print normColor + '\n' + '\n'.join(self.__fanOut.report())
+        super(MonitorFanOut, self).close()
+
+    def run(self):
+        system('clear')
+        self._out.write('Monitor started : ')
+        self._out.writeln('Baudrate=' + str(self._d.baudrate) +
+                          ' [Fan-out mode: ' + ', '.join(
+                              [t.sink.name for t in self.__fanOut.threads]) +
+                          ']')
+        self.__fanOut.run(self._single)
+
+
 def main():
     classDict = {
         'normal': globals()['MonitorNormal'],
         'hexdump': globals()['MonitorHexdump'],
-        'raw': globals()['MonitorRaw']
+        'raw': globals()['MonitorRaw'],
+        'ring': globals()['MonitorRing'],
+        'fanout': globals()['MonitorFanOut']
     }
     p = argparse.ArgumentParser(prog='RS485Monitor.py',
                                 description='Monitor FTDI RS485 Rx.')
     p.add_argument('--mode', '-m',
-                   choices=['normal', 'hexdump', 'raw'],
+                   choices=['normal', 'hexdump', 'raw', 'ring', 'fanout'],
                    default='normal',
                    help='Monitor mode')
 
@@ -154,15 +307,77 @@ def main():
     p.add_argument('--no-stdout',
                    default=False,
                    action='store_true',
-                   help='(dts) Disable stdout printing')
+                   help='(dts, raw) Disable stdout printing, e.g. to only \
+                       --record a capture')
 
     p.add_argument('--newline', '-r',
                    default=False,
                    action='store_true',
                    help='(dts) One line monitoring')
 
+    p.add_argument('--group', '-g',
+                   type=int,
+                   default=2,
+                   metavar='N',
+                   help='(raw) Print a \':\' separator every N bytes')
+
+    p.add_argument('--ring',
+                   type=str,
+                   default='',
+                   metavar='FILE',
+                   help='(ring) Circular capture file')
+
+    p.add_argument('--ring-size',
+                   type=int,
+                   default=64,
+                   metavar='MB',
+                   help='(ring) Size of the circular capture file')
+
+    p.add_argument('--trigger',
+                   type=str,
+                   default='',
+                   metavar='HEX',
+                   help='(ring) Freeze the ring when the byte pattern HEX \
+                       is received (SIGUSR1 always triggers)')
+
+    p.add_argument('--post-trigger',
+                   type=int,
+                   default=0,
+                   metavar='KB',
+                   help='(ring) Keep capturing KB kilobytes after the trigger')
+
+    p.add_argument('--force',
+                   default=False,
+                   action='store_true',
+                   help='(ring) Overwrite a frozen ring file')
+
+    p.add_argument('--sink',
+                   type=str,
+                   action='append',
+                   metavar='SPEC',
+                   help='(fanout) Send every read to sink SPEC (repeatable): \
+                       normal, hexdump, raw[:N], capture:FILE, \
+                       ring:FILE[:MB] or dts:DESC:CSV')
+
+    p.add_argument('--threaded', '-t',
+                   default=False,
+                   action='store_true',
+                   help='Read (and --record) the device from a dedicated \
+                       acquisition thread')
+
+    p.add_argument('--queue-size',
+                   type=int,
+                   default=1024,
+                   metavar='N',
+                   help='Acquisition queue length in chunks (with --threaded), \
+                       per sink queue length (fanout)')
+
+    addOutputArguments(p)
+    addSourceArguments(p, 4096)
+
     args = p.parse_args()
 
+    mon = None
     try:
         mon = classDict[args.mode](args)
         mon.run()
@@ -170,8 +385,12 @@ def main():
         print normColor + 'FTDI Exception caught : ' + e.args[0]
     except RS485MonitorException as e:
         print normColor + '[{0}] : {1}'.format(e.sender, e.msg)
+    except EOFError:
+        print normColor + '\nEnd of replayed stream'
     except KeyboardInterrupt:
         pass
+    if mon:
+        mon.close()
 
 
 if __name__ == "__main__":
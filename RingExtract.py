@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Extract a time window from a circular capture file written by
+RS485Monitor.py --mode ring. Only the chunk headers are read outside of the
+window. The extract is written as a capture file that can be replayed with
+--replay, or as plain bytes.
+"""
+from lib.RingCapture import RingCapture, RingCaptureException
+from lib.ByteSource import CaptureWriter
+from sys import stdout
+from time import localtime, strftime
+import argparse
+
+
+def formatTime(ts):
+    return strftime('%Y-%m-%d %H:%M:%S', localtime(ts)) + \
+        '.{0:03d}'.format(int(ts * 1000) % 1000)
+
+
+def main():
+    p = argparse.ArgumentParser(prog='RingExtract.py',
+                                description='Extract a time window from a \
+                                    circular capture file.')
+    p.add_argument('ring',
+                   type=str,
+                   metavar='RING',
+                   help='Circular capture file')
+
+    p.add_argument('--info', '-i',
+                   default=False,
+                   action='store_true',
+                   help='Print the ring state and time range and exit')
+
+    p.add_argument('--start',
+                   type=float,
+                   default=None,
+                   metavar='EPOCH',
+                   help='Window start (seconds since the epoch)')
+
+    p.add_argument('--end',
+                   type=float,
+                   default=None,
+                   metavar='EPOCH',
+                   help='Window end (seconds since the epoch)')
+
+    p.add_argument('--before', '-b',
+                   type=float,
+                   default=None,
+                   metavar='SECONDS',
+                   help='Window start relative to the trigger (or to the \
+                       last chunk when the ring is not frozen)')
+
+    p.add_argument('--after', '-a',
+                   type=float,
+                   default=None,
+                   metavar='SECONDS',
+                   help='Window end relative to the trigger')
+
+    p.add_argument('--output', '-o',
+                   type=str,
+                   default='',
+                   metavar='FILE',
+                   help='Output file (default: plain bytes on stdout)')
+
+    p.add_argument('--raw',
+                   default=False,
+                   action='store_true',
+                   help='Write plain bytes instead of a capture file')
+
+    a = p.parse_args()
+
+    try:
+        ring = RingCapture(a.ring)
+    except (RingCaptureException, IOError) as e:
+        print 'Cannot open ring : ' + str(e)
+        return
+
+    try:
+        first = last = None
+        if a.info or a.before is not None or a.after is not None:
+            for ts, length in ring.chunks(withData=False):
+                first = ts if first is None else first
+                last = ts
+        if a.info:
+            print 'Capacity: {0} bytes, {1} chunks, {2} bytes captured'.format(
+                ring.capacity, ring.records, ring.totalBytes)
+            if ring.frozen:
+                print 'Frozen, triggered at ' + formatTime(ring.triggerTime)
+            if first is not None:
+                print 'From {0} to {1} ({2:.3f} s)'.format(
+                    formatTime(first), formatTime(last), last - first)
+            return
+
+        start, end = a.start, a.end
+        if a.before is not None or a.after is not None:
+            reference = ring.triggerTime if ring.frozen else last
+            if a.before is not None and reference is not None:
+                start = reference - a.before
+            if a.after is not None and reference is not None:
+                end = reference + a.after
+
+        if a.raw or not len(a.output):
+            out = open(a.output, 'wb') if len(a.output) else stdout
+            for ts, data in ring.chunks(start, end):
+                out.write(data)
+            if out is not stdout:
+                out.close()
+        else:
+            writer = CaptureWriter(a.output, ring.baudrate)
+            for ts, data in ring.chunks(start, end):
+                writer.write(data, ts)
+            writer.close()
+    except RingCaptureException as e:
+        print 'Ring error : ' + e.args[0]
+    finally:
+        ring.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+SPI throughput benchmark.
+
+Sweeps the clock frequency, the transaction size and the chip-select
+framing, against a local MPSSE stand-in with a configurable per-call
+latency, or against the real FTDI device with --hardware (never picked
+automatically, the benchmark writes to whatever is on the bus). Every
+MPSSE call is timed, so the time spent on the wire, in the MPSSE calls and
+in Python between the calls can be told apart. Results are printed as
+transactions/s and bytes/s with exact per-call overhead percentiles, and
+can be saved as JSON to compare runs.
+"""
+from lib.FakeMPSSE import FakeMPSSE
+from lib.SPIBulk import makePattern
+from lib.Instrumentation import Samples
+from time import time
+import argparse
+import json
+
+FRAMINGS = ('chunk', 'single')
+
+
+def openDevice(hardware, frequency, latency):
+    if hardware:
+        from mpsse import MPSSE, SPI0
+        return MPSSE(SPI0, frequency)
+    return FakeMPSSE(frequency=frequency, callLatency=latency)
+
+
+def runCase(m, size, framing, total, maxTime):
+    '''
+    Write `total` bytes in `size` byte transactions, with Start()/Stop()
+    around every transaction ('chunk') or once around all of them
+    ('single'), stopping after `maxTime` seconds.
+    '''
+    clock = m.GetClock()
+    payload = makePattern('counter', size)
+    wire = size * 8. / clock
+    calls = Samples('us')
+    overhead = Samples('us')
+    python = Samples('us')
+    framed = framing == 'chunk'
+    count = max(1, total // size)
+    n = 0
+    start = time()
+    if not framed:
+        t = time()
+        m.Start()
+        calls.add((time() - t) * 1e6)
+    last = time()
+    for n in xrange(1, count + 1):
+        t0 = time()
+        if framed:
+            m.Start()
+        t1 = time()
+        m.Write(payload)
+        t2 = time()
+        if framed:
+            m.Stop()
+        t3 = time()
+        if framed:
+            calls.add((t1 - t0) * 1e6)
+            calls.add((t3 - t2) * 1e6)
+        calls.add(max(0., t2 - t1 - wire) * 1e6)
+        overhead.add(max(0., t3 - t0 - wire) * 1e6)
+        python.add((t0 - last) * 1e6)
+        last = t3
+        if t3 - start >= maxTime:
+            break
+    if not framed:
+        t = time()
+        m.Stop()
+        calls.add((time() - t) * 1e6)
+    elapsed = time() - start
+    return {'clock': clock, 'size': size, 'framing': framing,
+            'transactions': n, 'bytes': n * size, 'seconds': elapsed,
+            'transactionsPerSecond': n / elapsed,
+            'bytesPerSecond': n * size / elapsed,
+            'theoreticalBytesPerSecond': clock / 8.,
+            'callOverhead': calls.toDict(),
+            'transactionOverhead': overhead.toDict(),
+            'pythonOverhead': python.toDict()}
+
+
+def printCase(case):
+    h = case['callOverhead']
+    print '{0:>9} Hz {1:>7} B {2:<6} {3:>10.0f} tr/s {4:>12.0f} B/s ' \
+        '({5:5.1f} %)  call p50={6:.1f} p99={7:.1f} us  python p50={8:.1f} ' \
+        'us'.format(case['clock'], case['size'], case['framing'],
+                    case['transactionsPerSecond'], case['bytesPerSecond'],
+                    100 * case['bytesPerSecond'] /
+                    case['theoreticalBytesPerSecond'],
+                    h['p50'], h['p99'], case['pythonOverhead']['p50'])
+
+
+def main():
+    p = argparse.ArgumentParser(prog='SPIBenchmark.py',
+                                description='Benchmark SPI transfers.')
+    p.add_argument('--clock', '-f',
+                   type=int,
+                   action='append',
+                   metavar='HZ',
+                   help='Clock frequency (repeatable, default: 1 MHz, \
+                       6 MHz and 30 MHz)')
+
+    p.add_argument('--size', '-s',
+                   type=int,
+                   action='append',
+                   metavar='BYTES',
+                   help='Transaction size (repeatable, default: 2, 64, \
+                       1024 and 65536)')
+
+    p.add_argument('--framing',
+                   choices=FRAMINGS + ('both',),
+                   default='both',
+                   help='Chip select around every transaction (chunk), \
+                       once around all of them (single) or both')
+
+    p.add_argument('--total',
+                   type=int,
+                   default=1048576,
+                   metavar='BYTES',
+                   help='Bytes written per case')
+
+    p.add_argument('--max-time',
+                   type=float,
+                   default=2.,
+                   metavar='SECONDS',
+                   help='Stop a case after SECONDS')
+
+    p.add_argument('--latency',
+                   type=float,
+                   default=125.,
+                   metavar='US',
+                   help='Per-call latency of the MPSSE stand-in')
+
+    p.add_argument('--hardware',
+                   default=False,
+                   action='store_true',
+                   help='Benchmark the real FTDI device instead of the \
+                       stand-in')
+
+    p.add_argument('--output', '-o',
+                   type=str,
+                   default='',
+                   metavar='FILE',
+                   help='Save the results as JSON into FILE')
+
+    a = p.parse_args()
+
+    clocks = a.clock or [1000000, 6000000, 30000000]
+    sizes = a.size or [2, 64, 1024, 65536]
+    framings = FRAMINGS if a.framing == 'both' else (a.framing,)
+    print 'Device: ' + ('FTDI MPSSE' if a.hardware else
+                        'stand-in, {0:g} us per call'.format(a.latency))
+    cases = []
+    for clock in clocks:
+        try:
+            m = openDevice(a.hardware, clock, a.latency / 1e6)
+        except ImportError:
+            p.error('pylibmpsse is not available')
+        except Exception as e:
+            print 'Could not start FTDI Device : ' + str(e)
+            return
+        try:
+            for size in sizes:
+                for framing in framings:
+                    case = runCase(m, size, framing, a.total, a.max_time)
+                    printCase(case)
+                    cases.append(case)
+        except KeyboardInterrupt:
+            break
+        finally:
+            m.Close()
+
+    if len(a.output):
+        with open(a.output, 'w') as f:
+            json.dump({'hardware': a.hardware, 'latency': a.latency,
+                       'cases': cases}, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,9 @@
 #!/usr/bin/env python
 from mpsse import *
-from sys import stdout, exit
-from time import sleep
+from lib.SPIBulk import BulkTransfer, PATTERNS, makePattern, chunked, \
+    streamChunks
+from sys import stdout, stdin, exit
+from time import sleep, time
 import argparse
 
 
@@ -49,6 +51,41 @@ class SPITransmitter(object):
                 self._m.Close()
                 exit(1)
 
+    def runBulk(self, chunks, framed, total=0):
+        stdout.write('Transmitter started : Mode = SPI' + str(self._mode))
+        stdout.write('  |  Frequency = ' + str(self._m.GetClock()) + ' Hz')
+        stdout.write('  |  Bulk, ' + ('one transaction per chunk' if framed
+                                      else 'single transaction') + '\n')
+        t = BulkTransfer(self._m, framed)
+        state = {'last': time()}
+
+        def progress(t):
+            now = time()
+            if now - state['last'] >= 1:
+                state['last'] = now
+                stdout.write('\r{0} bytes{1} sent, {2:.0f} bytes/s   '.format(
+                    t.bytes, ' / ' + str(total) if total else '', t.rate))
+                stdout.flush()
+
+        try:
+            t.send(chunks, progress)
+        except KeyboardInterrupt:
+            pass
+        except Exception as e:
+            if (e.args[0] == 'all fine'):
+                print "\nException caught : Couldn't write to device"
+            else:
+                raise e
+        finally:
+            self._m.Close()
+        print '\r{0} bytes in {1} chunks, {2:.3f} s'.format(t.bytes, t.chunks,
+                                                          t.elapsed)
+        print 'Effective rate {0:.0f} bytes/s, theoretical {1:.0f} bytes/s ' \
+            '({2:.1f} %)'.format(t.rate, t.theoreticalRate,
+                                 100 * t.efficiency)
+        print 'Exiting transmitter'
+
+
 if __name__ == "__main__":
     p = argparse.ArgumentParser(description='Transmit characters on FTDI SPI.')
     p.add_argument('-m', '--mode',
@@ -64,6 +101,54 @@ if __name__ == "__main__":
                    type=int,
                    default='1',
                    help='Pause time between two frames in seconds')
+    src = p.add_mutually_exclusive_group()
+    src.add_argument('--file',
+                     type=str,
+                     metavar='FILE',
+                     help='Bulk mode: send the content of FILE')
+    src.add_argument('--pattern',
+                     choices=PATTERNS,
+                     help='Bulk mode: send --size bytes of a generated \
+                         pattern')
+    src.add_argument('--stdin',
+                     default=False,
+                     action='store_true',
+                     help='Bulk mode: send everything read from stdin')
+    p.add_argument('--size',
+                   type=int,
+                   default=1048576,
+                   metavar='BYTES',
+                   help='(bulk) Size of the generated pattern')
+    p.add_argument('--repeat',
+                   type=int,
+                   default=1,
+                   metavar='N',
+                   help='(bulk) Send the file or pattern N times')
+    p.add_argument('-c', '--chunk-size',
+                   type=int,
+                   default=65536,
+                   metavar='BYTES',
+                   help='(bulk) Bytes written per MPSSE Write()')
+    p.add_argument('--frame',
+                   default=False,
+                   action='store_true',
+                   help='(bulk) Assert chip select around every chunk \
+                       instead of once around the whole payload')
     args = p.parse_args()
+    if args.chunk_size <= 0:
+        p.error('--chunk-size must be positive')
+    payload = None
+    if args.file:
+        with open(args.file, 'rb') as f:
+            payload = f.read()
+    elif args.pattern:
+        payload = makePattern(args.pattern, args.size)
     t = SPITransmitter(args.mode, args.frequency, args.pause)
-    t.run()
+    if payload is not None:
+        chunks = (c for r in xrange(args.repeat)
+                  for c in chunked(payload, args.chunk_size))
+        t.runBulk(chunks, args.frame, len(payload) * args.repeat)
+    elif args.stdin:
+        t.runBulk(streamChunks(stdin, args.chunk_size), args.frame)
+    else:
+        t.run()
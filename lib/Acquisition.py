@@ -0,0 +1,112 @@
+'''
+Threaded acquisition
+
+A dedicated thread does nothing but read chunks from a byte source into a
+bounded queue, so that a slow consumer (terminal, log file) never keeps the
+FTDI FIFO from being drained. When the queue is full, chunks are dropped
+and the amount of dropped bytes is reported to the consumer right before
+the next chunk it receives, so it can resynchronize instead of splicing
+unrelated bytes together.
+
+Given a PipelineStats, the thread records the device reads themselves
+(count, size and latency); the consumer only sees queue waits.
+'''
+from threading import Thread, Event
+from Queue import Queue, Full, Empty
+from time import time
+
+
+class AcquisitionThread(Thread):
+    def __init__(self, source, maxChunks=1024, readSize=256, stats=None):
+        super(AcquisitionThread, self).__init__(name='acquisition')
+        self.daemon = True
+        self.queue = Queue(maxChunks)
+        self.overflows = 0
+        self.droppedBytes = 0
+        self.error = None
+        self._source = source
+        self._readSize = readSize
+        self._stats = stats
+        self._stop = Event()
+
+    def run(self):
+        dropped = 0
+        stats = self._stats
+        if stats:
+            readSize = stats.histograms['readSize']
+            readLatency = stats.histograms['readLatency']
+        while not self._stop.is_set():
+            try:
+                t = time()
+                data = self._source.read(self._readSize)
+            except Exception as e:
+                self.error = e
+                self.queue.put((None, dropped))
+                return
+            if stats:
+                readLatency.add((time() - t) * 1e6)
+                readSize.add(len(data))
+                stats.reads += 1
+                stats.bytesRead += len(data)
+            if not len(data):
+                continue
+            try:
+                self.queue.put_nowait((data, dropped))
+                dropped = 0
+            except Full:
+                self.overflows += 1
+                self.droppedBytes += len(data)
+                dropped += len(data)
+
+    def stop(self, timeout=1.):
+        self._stop.set()
+        self.join(timeout)
+
+
+class ThreadedSource(object):
+    '''
+    Byte source interface on top of an AcquisitionThread. `onOverflow` is
+    called with the number of dropped bytes before the data following a
+    queue overflow is returned. With a `readSize` of None, the thread reads
+    with the source's own read size (see ByteSource.AdaptiveSource). Like a
+    device read timing out, read() returns no data when nothing came within
+    `timeout` seconds.
+    '''
+    def __init__(self, source, maxChunks=1024, readSize=256, onOverflow=None,
+                 stats=None, timeout=.1):
+        self._source = source
+        self._timeout = timeout
+        self._onOverflow = onOverflow
+        self._pending = ''
+        self.thread = AcquisitionThread(source, maxChunks, readSize, stats)
+        self.thread.start()
+
+    @property
+    def baudrate(self):
+        return self._source.baudrate
+
+    def read(self, size=None):
+        if not self._pending:
+            # A timeout keeps the main thread responsive to signals
+            try:
+                data, dropped = self.thread.queue.get(True, self._timeout)
+            except Empty:
+                return ''
+            if dropped and self._onOverflow:
+                self._onOverflow(dropped)
+            if data is None:
+                raise self.thread.error
+            self._pending = data
+        if size is None:
+            data, self._pending = self._pending, ''
+            return data
+        data = self._pending[:size]
+        self._pending = self._pending[size:]
+        return data
+
+    def flush(self):
+        self._source.flush()
+
+    def close(self):
+        self.thread.stop()
+        self._source.close()
@@ -0,0 +1,84 @@
+'''
+Contiguous byte ring buffer
+
+Incoming chunks are appended at the tail of a preallocated bytearray and
+consumed from the head. When the tail reaches the end of the storage, the
+unread bytes are moved back to the front, so the unread data is always
+contiguous: patterns can be searched with bytearray.find and frames can be
+decoded in place (struct.unpack_from, memoryview) without copying them out.
+'''
+
+
+class ByteRing(object):
+    def __init__(self, capacity=65536):
+        self._buf = bytearray(capacity)
+        self._head = 0
+        self._tail = 0
+        self.consumed = 0
+
+    def __len__(self):
+        return self._tail - self._head
+
+    @property
+    def capacity(self):
+        return len(self._buf)
+
+    @property
+    def buffer(self):
+        '''Underlying storage, valid until the next write()'''
+        return self._buf
+
+    @property
+    def start(self):
+        '''Index of the first unread byte in buffer'''
+        return self._head
+
+    def write(self, data):
+        n = len(data)
+        if not n:
+            return
+        if self._tail + n > len(self._buf):
+            self._compact(n)
+        self._buf[self._tail:self._tail + n] = data
+        self._tail += n
+
+    def _compact(self, needed):
+        size = self._tail - self._head
+        if size + needed > len(self._buf):
+            capacity = len(self._buf)
+            while size + needed > capacity:
+                capacity *= 2
+            buf = bytearray(capacity)
+            buf[0:size] = self._buf[self._head:self._tail]
+            self._buf = buf
+        elif size:
+            self._buf[0:size] = self._buf[self._head:self._tail]
+        self._head = 0
+        self._tail = size
+
+    def find(self, pattern, offset=0):
+        idx = self._buf.find(pattern, self._head + offset, self._tail)
+        return idx - self._head if idx >= 0 else -1
+
+    def peek(self, offset, length):
+        start = self._head + offset
+        return str(self._buf[start:min(start + length, self._tail)])
+
+    def view(self, offset, length):
+        '''
+        Zero-copy view on unread bytes. The view must be released before the
+        next write() may need to grow the storage.
+        '''
+        start = self._head + offset
+        return memoryview(self._buf)[start:min(start + length, self._tail)]
+
+    def consume(self, n):
+        n = max(0, min(n, self._tail - self._head))
+        self._head += n
+        self.consumed += n
+        if self._head == self._tail:
+            self._head = self._tail = 0
+        return n
+
+    def clear(self):
+        self.consume(self._tail - self._head)
@@ -0,0 +1,358 @@
+'''
+Byte sources for the RS485 tools
+
+Every source mimics the subset of pylibftdi.Device used by the tools:
+read(size), flush(), close() and a baudrate attribute. Besides the FTDI
+device itself, a raw RX stream can be recorded to a capture file and
+replayed later from a file (memory-mapped) or from a pipe, either as fast
+as possible or at the original rate.
+
+The FTDI latency timer (how long the chip holds a partial USB packet) and
+the USB transfer size can be set when opening the device. Sources returned
+by openSource() also accept read() without a size: the read size then
+follows the fill level of the previous reads (see AdaptiveSource), and the
+fill statistics of every read are kept.
+
+Capture file layout (little endian):
+    header: 'FTDICAP1' | start time (double) | baudrate (uint32)
+    chunks: receive time (double) | length (uint32) | data
+Files without the header are replayed as a plain byte stream.
+'''
+from lib.Instrumentation import Histogram
+from struct import Struct
+from time import time, sleep
+from sys import stdin, stderr
+import mmap
+
+try:
+    from pylibftdi import Device, FtdiError
+except ImportError:
+    Device = None
+
+    class FtdiError(Exception):
+        pass
+
+CAPTURE_MAGIC = 'FTDICAP1'
+captureHeader = Struct('<8sdI')
+chunkHeader = Struct('<dI')
+
+
+class FtdiSource(object):
+    def __init__(self, baudrate=1250000, databits=8, stopbits=0,
+                 paritymode=2, serial=None, latencyTimer=None,
+                 transferSize=None):
+        '''
+        `latencyTimer` (1 to 255 ms, 16 ms by default on the chip) and
+        `transferSize` (USB read transfer size in bytes, a multiple of 64)
+        are left to the driver defaults when None.
+        '''
+        if Device is None:
+            raise FtdiError('pylibftdi is not installed')
+        try:
+            self._d = Device(device_id=serial) if serial else Device()
+            self._d.baudrate = baudrate
+            fn = self._d.ftdi_fn
+            fn.ftdi_set_line_property(databits, stopbits, paritymode)
+            if latencyTimer is not None:
+                if fn.ftdi_set_latency_timer(latencyTimer) < 0:
+                    raise FtdiError('cannot set latency timer')
+            if transferSize is not None:
+                if fn.ftdi_read_data_set_chunksize(transferSize) < 0:
+                    raise FtdiError('cannot set USB transfer size')
+            self._d.flush()
+        except FtdiError as e:
+            self._d = None
+            raise FtdiError('could not start FTDI Device "' + e.args[0] + '"')
+
+    @property
+    def baudrate(self):
+        return self._d.baudrate
+
+    def read(self, size):
+        return self._d.read(size)
+
+    def flush(self):
+        self._d.flush()
+
+    def close(self):
+        self._d.close()
+
+
+class ReplaySource(object):
+    '''
+    Replays a capture (or plain bytes) from any object having read(n).
+    End of stream is signaled with EOFError.
+    '''
+    def __init__(self, stream, realtime=False, baudrate=1250000):
+        self._stream = stream
+        self._realtime = realtime
+        self._pending = ''
+        self._t0 = None
+        self._wall0 = None
+        self.baudrate = baudrate
+        self.captured = False
+        magic = self._readExactly(len(CAPTURE_MAGIC))
+        if magic == CAPTURE_MAGIC:
+            rest = self._readExactly(captureHeader.size - len(magic))
+            magic, start, self.baudrate = captureHeader.unpack(magic + rest)
+            self.captured = True
+        else:
+            self._pending = magic
+
+    def _readExactly(self, size):
+        data = self._stream.read(size)
+        while len(data) < size:
+            more = self._stream.read(size - len(data))
+            if not more:
+                break
+            data += more
+        return data
+
+    def _nextChunk(self):
+        if not self.captured:
+            return self._stream.read(65536)
+        header = self._readExactly(chunkHeader.size)
+        if len(header) < chunkHeader.size:
+            return ''
+        ts, length = chunkHeader.unpack(header)
+        if self._realtime:
+            now = time()
+            if self._t0 is None:
+                self._t0, self._wall0 = ts, now
+            delay = (ts - self._t0) - (now - self._wall0)
+            if delay > 0:
+                sleep(delay)
+        return self._readExactly(length)
+
+    def read(self, size):
+        if not self._pending:
+            self._pending = self._nextChunk()
+            if not self._pending:
+                raise EOFError('end of replayed stream')
+        data = self._pending[:size]
+        self._pending = self._pending[size:]
+        return data
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self._stream.close()
+
+
+class FileSource(ReplaySource):
+    def __init__(self, path, realtime=False, baudrate=1250000):
+        self._file = open(path, 'rb')
+        try:
+            stream = mmap.mmap(self._file.fileno(), 0,
+                               access=mmap.ACCESS_READ)
+        except (ValueError, mmap.error):
+            # Empty files and non-regular files cannot be mapped
+            stream = self._file
+        super(FileSource, self).__init__(stream, realtime, baudrate)
+
+    def close(self):
+        super(FileSource, self).close()
+        if not self._file.closed:
+            self._file.close()
+
+
+class CaptureWriter(object):
+    def __init__(self, path, baudrate=0):
+        self._io = open(path, 'wb')
+        self._io.write(captureHeader.pack(CAPTURE_MAGIC, time(), baudrate))
+
+    def write(self, data, ts=None):
+        if len(data):
+            self._io.write(chunkHeader.pack(time() if ts is None else ts,
+                                            len(data)))
+            self._io.write(data)
+
+    def close(self):
+        if not self._io.closed:
+            self._io.close()
+
+
+class RecordingSource(object):
+    '''Records every chunk read from `source` into a capture file'''
+    def __init__(self, source, path):
+        self._source = source
+        self._writer = CaptureWriter(path, source.baudrate)
+
+    @property
+    def baudrate(self):
+        return self._source.baudrate
+
+    def read(self, size):
+        data = self._source.read(size)
+        self._writer.write(data)
+        return data
+
+    def flush(self):
+        self._source.flush()
+
+    def close(self):
+        self._writer.close()
+        self._source.close()
+
+
+class AdaptiveSource(object):
+    '''
+    Keeps per-read fill statistics of `source` and, with `adaptive`, sizes
+    the reads made without an explicit size from the previous fill levels:
+    a full read means more data is waiting, so the size doubles (up to
+    `maxSize`); a series of reads less than a quarter full halves it (down
+    to `minSize`), to keep the chunks handed to the tool small when the
+    bus is quiet.
+    '''
+    def __init__(self, source, readSize=256, adaptive=False, minSize=64,
+                 maxSize=65536, report=False):
+        self._source = source
+        self._adaptive = adaptive
+        self._minSize = minSize
+        self._maxSize = maxSize
+        self._report = report
+        self._low = 0
+        self.readSize = readSize
+        self.reads = 0
+        self.bytes = 0
+        self.fullReads = 0
+        self.emptyReads = 0
+        self.resizes = 0
+        self.fill = Histogram('%')
+        self.sizes = Histogram('bytes')
+
+    @property
+    def baudrate(self):
+        return self._source.baudrate
+
+    def read(self, size=None):
+        adapt = size is None
+        if adapt:
+            size = self.readSize
+        data = self._source.read(size)
+        n = len(data)
+        self.reads += 1
+        self.bytes += n
+        self.fill.add(100. * n / size)
+        self.sizes.add(size)
+        if n >= size:
+            self.fullReads += 1
+        elif not n:
+            self.emptyReads += 1
+        if adapt and self._adaptive:
+            if n >= size and size < self._maxSize:
+                self.readSize = min(self._maxSize, size * 2)
+                self.resizes += 1
+                self._low = 0
+            elif n < size // 4:
+                self._low += 1
+                if self._low >= 8 and size > self._minSize:
+                    self.readSize = max(self._minSize, size // 2)
+                    self.resizes += 1
+                    self._low = 0
+            else:
+                self._low = 0
+        return data
+
+    def toDict(self):
+        return {'reads': self.reads, 'bytes': self.bytes,
+                'fullReads': self.fullReads, 'emptyReads': self.emptyReads,
+                'resizes': self.resizes, 'readSize': self.readSize,
+                'fill': self.fill.toDict(), 'sizes': self.sizes.toDict()}
+
+    def line(self):
+        return '{0} reads, {1} bytes, {2} full ({3:.1f} %), {4} empty, ' \
+            'mean fill {5:.1f} %, read size {6} ({7} resizes)'.format(
+                self.reads, self.bytes, self.fullReads,
+                100. * self.fullReads / self.reads if self.reads else 0,
+                self.emptyReads, self.fill.mean, self.readSize, self.resizes)
+
+    def flush(self):
+        self._source.flush()
+
+    def close(self):
+        if self._report:
+            stderr.write('Device reads: ' + self.line() + '\n')
+        self._source.close()
+
+
+def addSourceArguments(p, readSize=256):
+    p.add_argument('--serial',
+                   type=str,
+                   default='',
+                   metavar='SERIAL',
+                   help='Open the FTDI device with serial number SERIAL')
+
+    p.add_argument('--latency-timer',
+                   type=int,
+                   default=None,
+                   metavar='MS',
+                   help='FTDI latency timer, 1 to 255 ms (lower for \
+                       latency, higher for throughput)')
+
+    p.add_argument('--transfer-size',
+                   type=int,
+                   default=None,
+                   metavar='BYTES',
+                   help='FTDI USB read transfer size (multiple of 64)')
+
+    p.add_argument('--read-size',
+                   type=int,
+                   default=readSize,
+                   metavar='BYTES',
+                   help='Bytes requested per device read (initial size \
+                       with --adaptive)')
+
+    p.add_argument('--adaptive',
+                   default=False,
+                   action='store_true',
+                   help='Adapt the read size to the fill level of the reads')
+
+    p.add_argument('--read-stats',
+                   default=False,
+                   action='store_true',
+                   help='Print the device read fill statistics on exit')
+
+    p.add_argument('--replay',
+                   type=str,
+                   default='',
+                   metavar='FILE',
+                   help='Read bytes from FILE instead of the FTDI device \
+                       (\'-\' for stdin)')
+
+    p.add_argument('--realtime',
+                   default=False,
+                   action='store_true',
+                   help='Replay a capture file at its original rate')
+
+    p.add_argument('--record',
+                   type=str,
+                   default='',
+                   metavar='FILE',
+                   help='Record the raw RX stream into capture FILE')
+
+
+def openSource(a, baudrate=1250000, databits=8, stopbits=0, paritymode=2):
+    replay = getattr(a, 'replay', '')
+    realtime = getattr(a, 'realtime', False)
+    if replay == '-':
+        source = ReplaySource(stdin, realtime, baudrate)
+    elif replay:
+        source = FileSource(replay, realtime, baudrate)
+    else:
+        latencyTimer = getattr(a, 'latency_timer', None)
+        transferSize = getattr(a, 'transfer_size', None)
+        if latencyTimer is not None and not 1 <= latencyTimer <= 255:
+            raise FtdiError('latency timer must be within 1 and 255 ms')
+        if transferSize is not None and \
+                (transferSize <= 0 or transferSize % 64):
+            raise FtdiError('USB transfer size must be a multiple of 64')
+        source = FtdiSource(baudrate, databits, stopbits, paritymode,
+                            getattr(a, 'serial', '') or None,
+                            latencyTimer, transferSize)
+    if getattr(a, 'record', ''):
+        source = RecordingSource(source, a.record)
+    return AdaptiveSource(source, getattr(a, 'read_size', 256),
+                          getattr(a, 'adaptive', False),
+                          report=getattr(a, 'read_stats', False))
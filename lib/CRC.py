@@ -0,0 +1,81 @@
+'''
+Table-driven CRC-8 (polynomial x^8 + x^2 + x + 1, MSB first, init 0)
+
+This is the CRC appended by the boards to every DTS frame. The reference
+implementation below is the historical bit-by-bit loop from DTSAnalyzer,
+kept to check the table against it.
+'''
+
+POLY = 0x1070 << 3
+
+
+def crc8Bitwise(data, crc=0):
+    crc <<= 8
+    for c in bytearray(data):
+        crc ^= c << 8
+        for i in range(8):
+            if (crc & 0x8000):
+                crc ^= POLY
+            crc <<= 1
+    return crc >> 8
+
+
+def _buildTable():
+    return [crc8Bitwise(chr(i)) for i in range(256)]
+
+
+class CRC8(object):
+    TABLE = _buildTable()
+
+    @staticmethod
+    def compute(data, crc=0, start=0, end=None):
+        table = CRC8.TABLE
+        if start or end is not None:
+            data = data[start:end]
+        for c in bytearray(data):
+            crc = table[crc ^ c]
+        return crc
+
+    @staticmethod
+    def check(data, crcIn, start=0, end=None):
+        if not isinstance(crcIn, int):
+            crcIn = ord(crcIn)
+        return CRC8.compute(data, 0, start, end) == crcIn
+
+    @staticmethod
+    def checkFrame(buf, offset, size):
+        '''
+        Validate the frame of `size` bytes at `offset` in bytearray `buf`,
+        immediately followed by its CRC byte.
+        '''
+        table = CRC8.TABLE
+        crc = 0
+        for c in buf[offset:offset + size]:
+            crc = table[crc ^ c]
+        return crc == buf[offset + size]
+
+    @staticmethod
+    def checkBatch(buf, offsets, size):
+        '''
+        Validate several frames of `size` bytes stored in `buf`, each one
+        immediately followed by its CRC byte. Returns a list of booleans.
+        '''
+        if not isinstance(buf, bytearray):
+            buf = bytearray(buf)
+        checkFrame = CRC8.checkFrame
+        return [checkFrame(buf, off, size) for off in offsets]
+
+
+def selfCheck(samples=2000, maxLen=64):
+    from random import randint
+    for i in range(256):
+        if CRC8.TABLE[i] != crc8Bitwise(chr(i)):
+            return False
+    for n in range(samples):
+        data = ''.join(chr(randint(0, 255)) for i in range(randint(0, maxLen)))
+        if CRC8.compute(data) != crc8Bitwise(data):
+            return False
+    return True
+
+if __name__ == '__main__':
+    print 'CRC8 table matches bitwise implementation: ' + str(selfCheck())
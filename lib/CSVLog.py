@@ -0,0 +1,192 @@
+'''
+DTS CSV log reader
+
+Streams the CSV logs written by DTSAnalyzer (and DTSMultiCapture) through
+a memory map, without loading them. A log is a sequence of sessions, each
+one made of '#' comment lines (the first session of a file has no
+separator line) followed by a 'Frame,<labels>' header and the data rows.
+
+A sidecar index (LOG.idx, JSON) records the sessions with the offset of
+every `stride`-th row and its frame number, so a frame range can be read
+back with one seek instead of a scan. The index is rebuilt when the log
+has changed since it was written.
+'''
+from bisect import bisect_right
+from os import path, stat
+import mmap
+import json
+
+INDEX_VERSION = 1
+DESCRIPTOR_TAG = 'using struct descriptor: \''
+
+
+class CSVLogException(Exception):
+    pass
+
+
+class CSVLogReader(object):
+    def __init__(self, logFile):
+        self.logFile = logFile
+        self._file = open(logFile, 'rb')
+        size = stat(logFile).st_size
+        self._map = mmap.mmap(self._file.fileno(), 0,
+                              access=mmap.ACCESS_READ) if size else None
+
+    def close(self):
+        if self._map:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def records(self, offset=0):
+        '''
+        Walk the log from `offset`, yielding ('session', info) for every
+        session header and ('rows', (offsets, rows)) for blocks of data
+        rows, each row being the list of its fields as strings.
+        '''
+        m = self._map
+        if m is None:
+            return
+        m.seek(offset)
+        readline = m.readline
+        comments = []
+        offsets, rows = [], []
+        while True:
+            pos = m.tell()
+            line = readline()
+            if not line:
+                break
+            line = line.rstrip('\r\n')
+            if not line:
+                continue
+            if line[0] == '#':
+                comments.append(line)
+                continue
+            if comments or line.startswith('Frame,'):
+                if rows:
+                    yield 'rows', (offsets, rows)
+                    offsets, rows = [], []
+                yield 'session', self._sessionInfo(pos, comments, line)
+                comments = []
+                continue
+            offsets.append(pos)
+            rows.append(line.split(','))
+            if len(rows) >= 4096:
+                yield 'rows', (offsets, rows)
+                offsets, rows = [], []
+        if rows:
+            yield 'rows', (offsets, rows)
+
+    @staticmethod
+    def _sessionInfo(offset, comments, header):
+        descriptor = ''
+        for c in comments:
+            i = c.find(DESCRIPTOR_TAG)
+            if i >= 0:
+                descriptor = c[i + len(DESCRIPTOR_TAG):].rstrip('\'')
+        columns = header.split(',')
+        if columns[0] != 'Frame':
+            raise CSVLogException('Missing \'Frame,<labels>\' header at ' +
+                                  'offset ' + str(offset))
+        return {'descriptor': descriptor, 'columns': columns,
+                'comments': comments, 'offset': offset}
+
+    def rowsFrom(self, offset, end=None, columns=None):
+        '''
+        Data rows from `offset` up to frame `end`, stopping at the next
+        session. Rows that don't have `columns` fields are skipped.
+        '''
+        for kind, item in self.records(offset):
+            if kind == 'session':
+                return
+            for row in item[1]:
+                if columns is not None and len(row) != columns:
+                    continue
+                try:
+                    frameNb = int(row[0])
+                except ValueError:
+                    continue
+                if end is not None and frameNb > end:
+                    return
+                yield row
+
+    def buildIndex(self, stride=1024, onRows=None, onSession=None):
+        '''
+        Scan the whole log, returning its index. `onSession(info)` and
+        `onRows(rows)` get the content of the log on the way, so that
+        other one pass computations don't need a second scan.
+        '''
+        sessions = []
+        current = None
+        n = 0
+        for kind, item in self.records():
+            if kind == 'session':
+                current = dict(item, frames=0, first=None, last=None,
+                               index=[])
+                del current['comments']
+                sessions.append(current)
+                n = 0
+                if onSession:
+                    onSession(item)
+                continue
+            if current is None:
+                raise CSVLogException('Data rows before any header')
+            offsets, rows = item
+            valid = []
+            for offset, row in zip(offsets, rows):
+                try:
+                    frameNb = int(row[0])
+                except ValueError:
+                    continue
+                if len(row) != len(current['columns']):
+                    # Truncated row, e.g. the logger was killed mid-write
+                    continue
+                if n % stride == 0:
+                    current['index'].append((frameNb, offset))
+                if current['first'] is None:
+                    current['first'] = frameNb
+                current['last'] = frameNb
+                n += 1
+                valid.append(row)
+            current['frames'] = n
+            if onRows and valid:
+                onRows(valid)
+        st = stat(self.logFile)
+        return {'version': INDEX_VERSION, 'size': st.st_size,
+                'mtime': st.st_mtime, 'stride': stride, 'sessions': sessions}
+
+
+def indexFile(logFile):
+    return logFile + '.idx'
+
+
+def loadIndex(logFile):
+    '''The sidecar index of `logFile`, or None if missing or stale'''
+    idx = indexFile(logFile)
+    if not path.exists(idx):
+        return None
+    try:
+        with open(idx) as f:
+            index = json.load(f)
+    except ValueError:
+        return None
+    st = stat(logFile)
+    if index.get('version') != INDEX_VERSION or \
+            index.get('size') != st.st_size or \
+            index.get('mtime') != st.st_mtime:
+        return None
+    return index
+
+
+def saveIndex(logFile, index):
+    with open(indexFile(logFile), 'w') as f:
+        json.dump(index, f)
+
+
+def seekOffset(session, frameNb):
+    '''Offset of the indexed row to start reading frame `frameNb` from'''
+    entries = session['index']
+    if not entries:
+        return None
+    i = bisect_right([e[0] for e in entries], frameNb) - 1
+    return entries[max(0, i)][1]
@@ -0,0 +1,22 @@
+'''
+Weak method callbacks
+
+A bound method handed to an object that its instance owns (frame parser,
+acquisition thread, signal handler) makes a reference cycle. Python 2
+never collects cycles holding an object with a __del__ method, so the
+instance would never be destroyed and its __del__ never run. weakMethod()
+returns a callback that only holds a weak reference to the instance, and
+does nothing once the instance is gone.
+'''
+import weakref
+
+
+def weakMethod(method):
+    ref = weakref.ref(method.im_self)
+    func = method.im_func
+
+    def callback(*args, **kwargs):
+        obj = ref()
+        if obj is not None:
+            return func(obj, *args, **kwargs)
+    return callback
@@ -0,0 +1,37 @@
+'''
+Monotonic clock
+
+CLOCK_MONOTONIC is system wide, so timestamps taken in different processes
+share the same time base. Falls back to time.time() where clock_gettime is
+not available.
+'''
+from time import time
+import ctypes
+import ctypes.util
+import os
+
+CLOCK_MONOTONIC = 1
+
+
+class _timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+def _loadClock():
+    try:
+        librt = ctypes.CDLL(ctypes.util.find_library('rt') or 'librt.so.1',
+                            use_errno=True)
+        clockGettime = librt.clock_gettime
+        clockGettime.argtypes = [ctypes.c_int, ctypes.POINTER(_timespec)]
+    except (OSError, AttributeError):
+        return time
+
+    def monotonic():
+        ts = _timespec()
+        if clockGettime(CLOCK_MONOTONIC, ctypes.byref(ts)):
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        return ts.tv_sec + ts.tv_nsec * 1e-9
+    return monotonic
+
+monotonic = _loadClock()
@@ -0,0 +1,75 @@
+'''
+Refresh-capped terminal dashboard
+
+Statistics are updated for every decoded batch, but the screen is redrawn
+at most `rate` times per second, whatever the frame rate is.
+'''
+from lib.Stats import RunningStats
+from time import time
+
+normColor = '\x1b[0;0m'
+lablColor = '\x1b[33m'
+valuColor = '\x1b[1;37m'
+home = '\x1b[H'
+clearEol = '\x1b[K'
+
+
+class Dashboard(object):
+    def __init__(self, out, labels, rate=20., title=''):
+        self._out = out
+        self._labels = labels
+        self._period = 1. / rate if rate > 0 else 0.
+        self._title = title
+        self._stats = [RunningStats() for l in labels]
+        self._latest = None
+        self._frames = 0
+        self._crcErrors = 0
+        self._lastFrames = 0
+        self._lastCrcErrors = 0
+        self._lastDraw = 0.
+        self._frameRate = 0.
+        self._crcRate = 0.
+        self._width = max([len(l) for l in labels] + [5])
+
+    def update(self, columns, latest, frames, crcErrors):
+        '''
+        `columns` maps every label to the values of the last batch, `latest`
+        is the last decoded row. `frames` and `crcErrors` are running totals.
+        '''
+        for label, stats in zip(self._labels, self._stats):
+            stats.updateBatch(columns[label])
+        self._latest = latest
+        self._frames = frames
+        self._crcErrors = crcErrors
+        now = time()
+        if now - self._lastDraw >= self._period:
+            self.draw(now)
+
+    def draw(self, now=None):
+        now = time() if now is None else now
+        elapsed = now - self._lastDraw
+        if self._lastDraw and elapsed > 0:
+            self._frameRate = (self._frames - self._lastFrames) / elapsed
+            self._crcRate = (self._crcErrors - self._lastCrcErrors) / elapsed
+        self._lastDraw = now
+        self._lastFrames = self._frames
+        self._lastCrcErrors = self._crcErrors
+
+        lines = [home + self._title + clearEol]
+        lines.append(('Frames: {0}  ({1:.1f} frames/s)   CRC errors: {2} '
+                      '({3:.1f}/s, {4:.3f}%)' + clearEol).format(
+            self._frames, self._frameRate, self._crcErrors, self._crcRate,
+            100. * self._crcErrors / self._frames if self._frames else 0.))
+        lines.append(('{0:<{w}} | {1:>19} | {2:>14} | {3:>14} | {4:>14} | '
+                      '{5:>14}' + clearEol).format('label', 'latest', 'min',
+                                                   'max', 'mean', 'stddev',
+                                                   w=self._width))
+        for i, stats in enumerate(self._stats):
+            latest = self._latest[i] if self._latest is not None else ''
+            lines.append(('{lC}{l:<{w}}{nC} | {vC}{v:>19}{nC} | {mn:>14} | '
+                          '{mx:>14} | {me:>14.6g} | {sd:>14.6g}' +
+                          clearEol).format(
+                lC=lablColor, l=self._labels[i], w=self._width, nC=normColor,
+                vC=valuColor, v=latest, mn=stats.min, mx=stats.max,
+                me=stats.mean, sd=stats.stddev))
+        self._out.write('\n'.join(lines) + '\n')
@@ -0,0 +1,184 @@
+'''
+DTS struct descriptor compiler
+
+A descriptor is a JSON file giving the endianess ('B' or 'L') and the
+ordered list of the frame items, each one a {"label": "type"} object. An
+item type may be an array, e.g. {"current": "uInt16[16]"}, which expands to
+the labels current[0] .. current[15].
+
+The compiled descriptor holds a precompiled struct.Struct and the format
+templates used to print a decoded frame to the terminal and to the CSV log.
+Compiled descriptors are cached on disk, keyed by the SHA-1 of the file
+content, so unchanged descriptors are not parsed and validated again.
+Cache files are written aside and renamed into place, as several capture
+processes may compile the same descriptor at once; an unreadable cache
+file is simply compiled again.
+'''
+from struct import Struct
+from hashlib import sha1
+from os import path, makedirs, rename, remove, fdopen
+from tempfile import mkstemp
+import cPickle as pickle
+import json
+import re
+
+COMPILER_VERSION = 1
+CACHE_DIR = path.join(path.expanduser('~'), '.cache', 'python-tools',
+                      'descriptors')
+
+normColor = '\x1b[0;0m'
+lablColor = '\x1b[33m'
+valuColor = '\x1b[1;37m'
+
+endianKeys = {'B': '>', 'L': '<'}
+typeKeys = {
+    "sInt16": {"key": 'h', "size": 2},
+    "uInt16": {"key": 'H', "size": 2},
+    "sInt32": {"key": 'i', "size": 4},
+    "uInt32": {"key": 'I', "size": 4},
+    "sInt64": {"key": 'q', "size": 8},
+    "uInt64": {"key": 'Q', "size": 8},
+    "float": {"key": 'f', "size": 4},
+    "double": {"key": 'd', "size": 8},
+    "byte": {"key": 'x', "size": 1}
+    }
+_itemRgx = re.compile(r'^(\w+)(?:\[([0-9]+)\])?$')
+
+
+class DescriptorException(Exception):
+    def __init__(self, sender, msg):
+        self.sender = sender
+        self.msg = msg
+
+    def __str__(self):
+        return repr(self.msg)
+
+
+class CompiledDescriptor(object):
+    def __init__(self, descFile, desc, fmt, labels, dataSize):
+        self.descFile = descFile
+        self.desc = desc
+        self.format = fmt
+        self.labels = labels
+        self.dataSize = dataSize
+        self.struct = Struct(fmt)
+        self.termFormat = self._termFormat(labels)
+        self.csvFormat = ','.join('{' + str(i) + '}'
+                                  for i in range(len(labels) + 1)) + '\n'
+
+    @staticmethod
+    def _termFormat(labels):
+        fields = ['| ']
+        for i, label in enumerate(labels):
+            label = label.replace('{', '{{').replace('}', '}}')
+            fields.append(lablColor + '[' + label + ']' + normColor + ': ' +
+                          valuColor + '{' + str(i) + ':>19}' + normColor +
+                          ' | ')
+        return ''.join(fields)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['struct']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.struct = Struct(self.format)
+
+
+def parseDescriptor(descFile, content):
+    try:
+        desc = json.loads(content)
+    except ValueError as e:
+        raise DescriptorException('loadStructDesc:json.loads', e.args[0])
+
+    if not type(desc) == dict or \
+        not len(desc) == 2 or \
+            'endianess' not in desc.keys() or \
+            'items' not in desc.keys():
+        raise DescriptorException('loadFrameDesc',
+                                  'Invalid frame descriptor')
+
+    if not desc['endianess'] in endianKeys:
+        raise DescriptorException('loadFrameDesc', 'Unrecognized endianess')
+    fmt = endianKeys[desc['endianess']]
+
+    if type(desc['items']) != list:
+        raise DescriptorException('loadFrameDesc',
+                                  'Unrecognized item list format')
+
+    labels = []
+    dataSize = 0
+    for item in desc['items']:
+        if type(item) != dict or \
+                len(item.values()) != 1 or len(item.keys()) != 1:
+            raise DescriptorException('loadFrameDesc',
+                                      'Unrecognized item size')
+
+        m = isinstance(item.values()[0], basestring) and \
+            _itemRgx.match(item.values()[0])
+        if not m or not m.group(1) in typeKeys:
+            raise DescriptorException('loadFrameDesc',
+                                      'Unrecognized item type')
+        typeStr = m.group(1).encode('ascii')
+        count = int(m.group(2)) if m.group(2) is not None else 1
+        if count < 1:
+            raise DescriptorException('loadFrameDesc',
+                                      'Invalid item array length')
+
+        fmt += (str(count) if count > 1 else '') + typeKeys[typeStr]["key"]
+        dataSize += count * typeKeys[typeStr]["size"]
+        if typeStr != "byte":
+            label = item.keys()[0].encode('ascii')
+            if m.group(2) is None:
+                labels.append(label)
+            else:
+                labels.extend(label + '[' + str(i) + ']'
+                              for i in range(count))
+
+    if dataSize % 2:
+        raise DescriptorException('loadFrameDesc', 'Data size is not even')
+    return CompiledDescriptor(descFile, desc, fmt, labels, dataSize)
+
+
+def compileDescriptor(descFile, cacheDir=CACHE_DIR):
+    with open(descFile) as f:
+        content = f.read()
+    key = sha1(str(COMPILER_VERSION) + content).hexdigest()
+    cacheFile = path.join(cacheDir, key + '.pickle') if cacheDir else None
+
+    if cacheFile and path.exists(cacheFile):
+        try:
+            with open(cacheFile, 'rb') as f:
+                compiled = pickle.load(f)
+            if isinstance(compiled, CompiledDescriptor):
+                compiled.descFile = descFile
+                return compiled
+        except Exception:
+            # Truncated, stale or foreign pickle: compile again
+            pass
+
+    compiled = parseDescriptor(descFile, content)
+    if cacheFile:
+        _writeCache(cacheFile, compiled)
+    return compiled
+
+
+def _writeCache(cacheFile, compiled):
+    cacheDir = path.dirname(cacheFile)
+    try:
+        if not path.isdir(cacheDir):
+            makedirs(cacheDir)
+    except OSError:
+        # Created meanwhile by another process
+        if not path.isdir(cacheDir):
+            return
+    tmpFile = None
+    try:
+        fd, tmpFile = mkstemp(suffix='.tmp', dir=cacheDir)
+        with fdopen(fd, 'wb') as f:
+            pickle.dump(compiled, f, pickle.HIGHEST_PROTOCOL)
+        rename(tmpFile, cacheFile)
+    except (IOError, OSError, pickle.PicklingError):
+        if tmpFile and path.exists(tmpFile):
+            remove(tmpFile)
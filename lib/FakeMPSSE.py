@@ -0,0 +1,68 @@
+'''
+Local MPSSE stand-in
+
+Mimics the part of the pylibmpsse MPSSE API used by the SPI tools. Every
+call costs a fixed latency, standing for the USB round-trip, and writes
+additionally take the time the bytes would need on the wire at the
+actual clock. Delays are busy-waited, as sleep() is too coarse for
+sub-millisecond latencies.
+'''
+from time import time
+
+SPI0, SPI1, SPI2, SPI3 = 1, 2, 3, 4
+MSB, LSB = 0x00, 0x08
+BASE_CLOCK = 60000000
+
+
+def _wait(seconds):
+    end = time() + seconds
+    while time() < end:
+        pass
+
+
+class FakeMPSSE(object):
+    def __init__(self, mode=SPI0, frequency=1000000, endianess=MSB,
+                 callLatency=125e-6):
+        self._mode = mode
+        self._latency = callLatency
+        # MPSSE clock: 60 MHz / (2 * (1 + divisor)), rounded down
+        divisor = max(0, -(-BASE_CLOCK // (2 * frequency)) - 1)
+        self._clock = BASE_CLOCK // (2 * (1 + divisor))
+        self._started = False
+        self.calls = 0
+        self.bytesWritten = 0
+
+    def _call(self, nBytes=0):
+        self.calls += 1
+        _wait(self._latency + nBytes * 8. / self._clock)
+
+    def GetClock(self):
+        return self._clock
+
+    def Start(self):
+        self._call()
+        self._started = True
+
+    def Stop(self):
+        self._call()
+        self._started = False
+
+    def Write(self, data):
+        if not self._started:
+            raise Exception('Write outside of a Start()/Stop() transaction')
+        self._call(len(data))
+        self.bytesWritten += len(data)
+
+    def Read(self, size):
+        self._call(size)
+        return '\x00' * size
+
+    def Transfer(self, data):
+        self._call(len(data))
+        self.bytesWritten += len(data)
+        return '\x00' * len(data)
+
+    def Close(self):
+        # Like pylibmpsse, which drops its context: GetClock() returns 0
+        self._started = False
+        self._clock = 0
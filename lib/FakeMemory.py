@@ -0,0 +1,183 @@
+'''
+Local ALMemory stand-in
+
+Mimics the part of the ALMemory proxy API used by the board monitors, with
+a simulated device tree under Device/DeviceList, so that they can be run
+and timed without a robot. Every call counts as one round-trip and can be
+given a fixed latency to emulate the RPC cost.
+
+FakeALBroker and FakeALModule stand in for ALBroker and ALModule: modules
+are looked up by name when subscribing to micro events, and the broker
+thread updates the tree at a fixed rate and notifies the subscribers, like
+the robot does. Error codes are simulated as short pulses, set and cleared
+within the same update, which only subscribers can see.
+'''
+from random import Random
+from time import sleep
+from threading import Lock, Thread, Event
+
+PREFIX = 'Device/DeviceList'
+BOARD_KEYS = ('Error', 'ProgVersion', 'Ack', 'Nack', 'Temperature')
+
+modules = {}
+
+
+class FakeALModule(object):
+    def __init__(self, name):
+        self._name = name
+        modules[name] = self
+
+    def getName(self):
+        return self._name
+
+
+class FakeALMemory(object):
+    def __init__(self, boards=('ZeBoard',), keys=BOARD_KEYS, changeRate=.05,
+                 latency=0., seed=None):
+        '''
+        On every call (or broker update, see FakeALBroker), each value of
+        the tree changes with a probability of `changeRate`, except
+        ProgVersion which never changes.
+        '''
+        self._random = Random(seed)
+        self._changeRate = changeRate
+        self._latency = latency
+        self._lock = Lock()
+        self._data = {}
+        self._volatile = []
+        for b, board in enumerate(boards):
+            for key in keys:
+                k = '/'.join([PREFIX, board, key])
+                if key == 'ProgVersion':
+                    self._data[k] = 0x100 + b
+                else:
+                    self._data[k] = 0
+                    self._volatile.append(k)
+        self._subscribers = {}
+        self.tickOnCall = True
+        self.roundTrips = 0
+        self.keysRead = 0
+        self.pulses = 0
+
+    def _call(self, nKeys):
+        self.roundTrips += 1
+        self.keysRead += nKeys
+        if self.tickOnCall:
+            return self._tick()
+        return []
+
+    def _wait(self):
+        # Outside of the lock, so that concurrent calls overlap like RPCs
+        if self._latency:
+            sleep(self._latency)
+
+    def _tick(self):
+        '''Update the tree, returning the (key, value) notifications'''
+        events = []
+        if not self._changeRate:
+            return events
+        rnd = self._random.random
+        for k in self._volatile:
+            if rnd() < self._changeRate:
+                if k.endswith('/Error'):
+                    code = self._random.randint(1, 255)
+                    self.pulses += 1
+                    events.append((k, code))
+                    events.append((k, 0))
+                else:
+                    self._data[k] += 1
+                    events.append((k, self._data[k]))
+        return events
+
+    def _notify(self, events):
+        for key, value in events:
+            for module, message, method in self._subscribers.get(key, ()):
+                getattr(modules[module], method)(key, value, message)
+
+    def tick(self):
+        with self._lock:
+            events = self._tick()
+        self._notify(events)
+
+    def _get(self, method, key):
+        try:
+            return self._data[key]
+        except KeyError:
+            raise RuntimeError('\tALMemory::' + method + '\n\tThere is no ' +
+                               'data with the key "' + key + '"')
+
+    def getData(self, key):
+        self._wait()
+        with self._lock:
+            events = self._call(1)
+            value = self._get('getData', key)
+        self._notify(events)
+        return value
+
+    def getListData(self, keys):
+        self._wait()
+        with self._lock:
+            events = self._call(len(keys))
+            values = [self._get('getListData', k) for k in keys]
+        self._notify(events)
+        return values
+
+    def getDataList(self, filter):
+        self._wait()
+        with self._lock:
+            events = self._call(0)
+            keys = sorted(k for k in self._data if filter in k)
+        self._notify(events)
+        return keys
+
+    def insertData(self, key, value):
+        self._wait()
+        with self._lock:
+            events = self._call(0)
+            self._data[key] = value
+        self._notify(events + [(key, value)])
+
+    def subscribeToMicroEvent(self, name, module, message, method):
+        self._wait()
+        with self._lock:
+            events = self._call(0)
+            if module not in modules:
+                raise RuntimeError('\tALMemory::subscribeToMicroEvent\n\t' +
+                                   'Module "' + module + '" not found')
+            if not hasattr(modules[module], method):
+                raise RuntimeError('\tALMemory::subscribeToMicroEvent\n\t' +
+                                   'Method "' + method + '" not found')
+            self._get('subscribeToMicroEvent', name)
+            subscribers = self._subscribers.setdefault(name, [])
+            subscribers[:] = [s for s in subscribers if s[0] != module]
+            subscribers.append((module, message, method))
+        self._notify(events)
+
+    def unsubscribeToMicroEvent(self, name, module):
+        self._wait()
+        with self._lock:
+            events = self._call(0)
+            self._subscribers[name] = [s for s in self._subscribers.get(
+                name, ()) if s[0] != module]
+        self._notify(events)
+
+
+class FakeALBroker(object):
+    def __init__(self, memory, rate=100.):
+        '''Update `memory` `rate` times per second from a thread'''
+        self._memory = memory
+        self._period = 1. / rate
+        self._stop = Event()
+        memory.tickOnCall = False
+        self._thread = Thread(target=self._run, name='broker')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self._period):
+            self._memory.tick()
+
+    def shutdown(self):
+        self._stop.set()
+        self._thread.join()
+        self._memory.tickOnCall = True
@@ -0,0 +1,231 @@
+'''
+Single-read fan-out
+
+One acquisition loop reads the device and hands every chunk to several
+sinks. Each sink runs in its own thread behind a bounded queue, so a slow
+sink (e.g. a terminal) only drops its own chunks and never holds back the
+acquisition or the other sinks.
+
+Sink specifications, as given on the command line:
+    normal              bytes as received, on stdout
+    hexdump             hexdump on stdout
+    raw[:N]             hex bytes with a ':' every N bytes, on stdout
+    capture:FILE        timestamped capture file (replayable with --replay)
+    ring:FILE[:MB]      circular capture file (see RingExtract.py)
+    dts:DESC:CSV        DTS frames decoded with struct descriptor DESC
+                        into the CSV log CSV
+'''
+from lib.Output import Hexdump, rawHex
+from lib.ByteSource import CaptureWriter
+from lib.RingCapture import RingCapture
+from lib.Descriptor import compileDescriptor
+from lib.FrameParser import FrameParser
+from lib.FrameDecoder import BatchDecoder
+from threading import Thread
+from Queue import Queue, Full, Empty
+from time import time
+from os import path
+
+
+class Sink(object):
+    name = 'sink'
+
+    def write(self, data, ts):
+        pass
+
+    def idle(self):
+        '''Called when no data came for a while'''
+        pass
+
+    def close(self):
+        pass
+
+
+class NormalSink(Sink):
+    def __init__(self, out):
+        self.name = 'normal'
+        self._out = out
+
+    def write(self, data, ts):
+        self._out.write(data)
+
+
+class HexdumpSink(Sink):
+    def __init__(self, out):
+        self.name = 'hexdump'
+        self._hexdump = Hexdump(out)
+
+    def write(self, data, ts):
+        self._hexdump.write(data)
+
+    def idle(self):
+        self._hexdump.flush()
+
+    def close(self):
+        self._hexdump.flush()
+
+
+class RawSink(Sink):
+    def __init__(self, out, group=2):
+        self.name = 'raw'
+        self._out = out
+        self._group = group
+
+    def write(self, data, ts):
+        self._out.write(rawHex(data, self._group))
+
+
+class CaptureSink(Sink):
+    def __init__(self, captureFile, baudrate=0):
+        self.name = 'capture:' + captureFile
+        self._writer = CaptureWriter(captureFile, baudrate)
+
+    def write(self, data, ts):
+        self._writer.write(data, ts)
+
+    def close(self):
+        self._writer.close()
+
+
+class RingSink(Sink):
+    def __init__(self, ringFile, sizeMB=64, baudrate=0):
+        self.name = 'ring:' + ringFile
+        self._ring = RingCapture(ringFile, sizeMB * 1024 * 1024, baudrate)
+
+    def write(self, data, ts):
+        self._ring.write(data, ts)
+
+    def close(self):
+        self._ring.close()
+
+
+class DTSSink(Sink):
+    def __init__(self, descFile, logFile):
+        self.name = 'dts:' + logFile
+        self._desc = compileDescriptor(descFile)
+        self._parser = FrameParser(self._desc.dataSize)
+        self._decoder = BatchDecoder(self._desc.format, self._desc.labels)
+        mode = 'a' if path.exists(logFile) else 'w'
+        self._logIO = open(logFile, mode)
+        if mode == 'a':
+            self._logIO.write('\n\n\n' + '#' * 79 + '\n')
+        self._logIO.write('# Log generated with DTS logger and using struct '
+                          'descriptor: \'' + descFile + '\'\n')
+        self._logIO.write('Frame,' + ','.join(self._desc.labels) + '\n')
+
+    def write(self, data, ts):
+        self._parser.feed(data)
+        frameNbs, payloads = self._parser.frames()
+        if frameNbs:
+            csvFormat = self._desc.csvFormat
+            rows = self._decoder.rows(self._decoder.decode(payloads))
+            self._logIO.write(''.join([csvFormat.format(nb, *values)
+                                       for nb, values in zip(frameNbs,
+                                                             rows)]))
+
+    def close(self):
+        self._logIO.close()
+
+
+def makeSink(spec, out, baudrate=0):
+    fields = spec.split(':')
+    kind = fields[0]
+    if kind == 'normal' and len(fields) == 1:
+        return NormalSink(out)
+    if kind == 'hexdump' and len(fields) == 1:
+        return HexdumpSink(out)
+    if kind == 'raw' and len(fields) <= 2:
+        return RawSink(out, int(fields[1]) if len(fields) == 2 else 2)
+    if kind == 'capture' and len(fields) == 2:
+        return CaptureSink(fields[1], baudrate)
+    if kind == 'ring' and len(fields) in (2, 3):
+        return RingSink(fields[1], int(fields[2]) if len(fields) == 3 else 64,
+                        baudrate)
+    if kind == 'dts' and len(fields) == 3:
+        return DTSSink(fields[1], fields[2])
+    raise ValueError('Invalid sink \'' + spec + '\'')
+
+
+class SinkThread(Thread):
+    IDLE_TIMEOUT = .1
+
+    def __init__(self, sink, maxChunks=1024):
+        super(SinkThread, self).__init__(name=sink.name)
+        self.daemon = True
+        self.sink = sink
+        self.queue = Queue(maxChunks)
+        self.droppedChunks = 0
+        self.droppedBytes = 0
+        self.error = None
+
+    def put(self, data, ts):
+        try:
+            self.queue.put_nowait((data, ts))
+        except Full:
+            self.droppedChunks += 1
+            self.droppedBytes += len(data)
+
+    def run(self):
+        idle = False
+        while True:
+            try:
+                item = self.queue.get(True, self.IDLE_TIMEOUT)
+            except Empty:
+                if not idle and self.error is None:
+                    idle = True
+                    try:
+                        self.sink.idle()
+                    except Exception as e:
+                        self.error = e
+                continue
+            if item is None:
+                break
+            idle = False
+            if self.error is None:
+                try:
+                    self.sink.write(*item)
+                except Exception as e:
+                    self.error = e
+
+    def stop(self, timeout=5.):
+        self.queue.put(None)
+        self.join(timeout)
+        self.sink.close()
+
+
+class FanOut(object):
+    def __init__(self, source, sinks, readSize=None, maxChunks=1024):
+        self._source = source
+        self._readSize = readSize
+        self.threads = [SinkThread(sink, maxChunks) for sink in sinks]
+        self.bytesRead = 0
+
+    def run(self, single=0):
+        for t in self.threads:
+            t.start()
+        count = 0
+        try:
+            while True:
+                data = self._source.read(self._readSize)
+                if not len(data):
+                    continue
+                ts = time()
+                self.bytesRead += len(data)
+                for t in self.threads:
+                    t.put(data, ts)
+                count += 1
+                if single and count >= single:
+                    break
+        finally:
+            for t in self.threads:
+                t.stop()
+
+    def report(self):
+        lines = []
+        for t in self.threads:
+            line = '{0}: {1} chunks / {2} bytes dropped'.format(
+                t.sink.name, t.droppedChunks, t.droppedBytes)
+            if t.error is not None:
+                line += ', stopped on error: ' + str(t.error)
+            lines.append(line)
+        return lines
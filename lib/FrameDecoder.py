@@ -0,0 +1,82 @@
+'''
+Batch decoding of DTS frame payloads
+
+The struct format string compiled from a JSON descriptor is turned into a
+NumPy structured dtype, so that many contiguous payloads are decoded with a
+single np.frombuffer call into columnar arrays. When NumPy is not available
+the decoder falls back to one struct.unpack_from per frame.
+'''
+from struct import Struct
+import re
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+_dtypeKeys = {
+    'h': 'i2', 'H': 'u2',
+    'i': 'i4', 'I': 'u4',
+    'q': 'i8', 'Q': 'u8',
+    'f': 'f4', 'd': 'f8'
+    }
+_formatRgx = re.compile('([0-9]*)([a-zA-Z])')
+
+
+def compileDtype(fmt, labels):
+    '''
+    Build the structured dtype matching the struct format `fmt`. Padding
+    bytes ('x') get no field, every other item consumes one label.
+    '''
+    if np is None:
+        raise ImportError('NumPy is required to compile a dtype')
+    endian = fmt[0] if fmt[0] in '<>' else '='
+    names, formats, offsets = [], [], []
+    offset = 0
+    labelIt = iter(labels)
+    for count, key in _formatRgx.findall(fmt.lstrip('<>=!@')):
+        count = int(count) if count else 1
+        if key == 'x':
+            offset += count
+            continue
+        if key not in _dtypeKeys:
+            raise ValueError('Unsupported struct key \'' + key + '\'')
+        code = endian + _dtypeKeys[key]
+        for i in range(count):
+            names.append(next(labelIt))
+            formats.append(code)
+            offsets.append(offset)
+            offset += np.dtype(code).itemsize
+    return np.dtype({'names': names, 'formats': formats,
+                     'offsets': offsets, 'itemsize': offset})
+
+
+class BatchDecoder(object):
+    def __init__(self, fmt, labels, useNumpy=True):
+        self._struct = Struct(fmt)
+        self.labels = list(labels)
+        self.size = self._struct.size
+        self.dtype = compileDtype(fmt, labels) if useNumpy and np else None
+
+    def decode(self, payloads):
+        '''
+        Decode a buffer holding whole payloads back to back. Returns a NumPy
+        structured array, or a list of tuples without NumPy.
+        '''
+        if self.dtype is not None:
+            return np.frombuffer(payloads, self.dtype,
+                                 len(payloads) // self.size)
+        unpack = self._struct.unpack_from
+        return [unpack(payloads, off)
+                for off in xrange(0, len(payloads) - self.size + 1,
+                                  self.size)]
+
+    @staticmethod
+    def rows(batch):
+        return batch.tolist() if hasattr(batch, 'tolist') else batch
+
+    def columns(self, batch):
+        if self.dtype is not None:
+            return dict((l, batch[l]) for l in self.labels)
+        return dict(zip(self.labels, zip(*batch) or
+                        [()] * len(self.labels)))
@@ -0,0 +1,73 @@
+'''
+Synthetic DTS frame generator
+
+Produces valid byte streams (SOF, payload, CRC) for a compiled struct
+descriptor, optionally with line noise between frames, truncated frames
+and CRC errors, to exercise the analyzer without hardware.
+'''
+from lib.FrameParser import SOF
+from lib.CRC import CRC8
+from struct import calcsize
+import random
+import re
+
+_formatRgx = re.compile('([0-9]*)([a-zA-Z])')
+_ranges = {
+    'h': (-2 ** 15, 2 ** 15 - 1), 'H': (0, 2 ** 16 - 1),
+    'i': (-2 ** 31, 2 ** 31 - 1), 'I': (0, 2 ** 32 - 1),
+    'q': (-2 ** 63, 2 ** 63 - 1), 'Q': (0, 2 ** 64 - 1)
+    }
+
+
+class FrameGenerator(object):
+    def __init__(self, desc, seed=None, sof=SOF):
+        self._desc = desc
+        self._sof = sof
+        self._rand = random.Random(seed)
+        self._keys = []
+        for count, key in _formatRgx.findall(desc.format.lstrip('<>=!@')):
+            if key != 'x':
+                self._keys.extend([key] * (int(count) if count else 1))
+        self.frameSize = len(sof) + calcsize(desc.format) + 1
+        self.crcErrors = 0
+        self.truncated = 0
+        self.noiseBytes = 0
+
+    def values(self):
+        rand = self._rand
+        values = []
+        for key in self._keys:
+            if key in _ranges:
+                values.append(rand.randint(*_ranges[key]))
+            else:
+                values.append(rand.uniform(-1e3, 1e3))
+        return values
+
+    def frame(self, values=None):
+        frame = self._sof + self._desc.struct.pack(
+            *(self.values() if values is None else values))
+        return frame + chr(CRC8.compute(frame))
+
+    def stream(self, count, noise=0., truncate=0., crcError=0.):
+        '''
+        `count` frames back to back. Each frame is preceded by 1 to 8 random
+        bytes with probability `noise`, cut short with probability
+        `truncate`, and has a wrong CRC with probability `crcError`.
+        '''
+        rand = self._rand
+        chunks = []
+        for n in xrange(count):
+            if noise and rand.random() < noise:
+                junk = ''.join(chr(rand.randint(0, 255))
+                               for i in range(rand.randint(1, 8)))
+                chunks.append(junk)
+                self.noiseBytes += len(junk)
+            frame = self.frame()
+            if crcError and rand.random() < crcError:
+                frame = frame[:-1] + chr(ord(frame[-1]) ^ 0xFF)
+                self.crcErrors += 1
+            if truncate and rand.random() < truncate:
+                frame = frame[:rand.randint(len(self._sof), len(frame) - 1)]
+                self.truncated += 1
+            chunks.append(frame)
+        return ''.join(chunks)
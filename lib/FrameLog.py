@@ -0,0 +1,171 @@
+'''
+Compact binary DTS frame log
+
+The log is a sequence of records, each one starting with a 4 byte tag and
+the length of its body (uint32, little endian):
+    'DTSL': session header, JSON body with the descriptor, its compiled
+            struct format, labels and payload size
+    'CHNK': first frame number (uint64) | timestamp (double) | count (uint32)
+            followed by count frame numbers (uint64) and count raw payloads
+    'INDX': sparse index of the session, one entry per chunk:
+            first frame number (uint64) | timestamp (double) | offset (uint64)
+Like the CSV log, an existing file is appended a new session. The index is
+written when the session is closed; it is rebuilt from the chunk headers
+for sessions that were not closed properly, and a record cut short at the
+end of the file (the logger was killed mid-write) is ignored.
+'''
+from struct import Struct
+from time import time
+from os import path
+import json
+
+recordHeader = Struct('<4sI')
+chunkHeader = Struct('<QdI')
+indexEntry = Struct('<QdQ')
+
+
+class FrameLogException(Exception):
+    pass
+
+
+class FrameLogWriter(object):
+    def __init__(self, logFile, meta, chunkFrames=1024):
+        self._dataSize = meta['dataSize']
+        self._chunkFrames = chunkFrames
+        self._frameNbs = []
+        self._payloads = bytearray()
+        self._chunkTime = 0
+        self._index = []
+        self._io = open(logFile, 'ab')
+        self._writeRecord('DTSL', json.dumps(meta))
+
+    @property
+    def closed(self):
+        return self._io.closed
+
+    def _writeRecord(self, tag, body):
+        self._io.write(recordHeader.pack(tag, len(body)))
+        self._io.write(body)
+
+    def write(self, frameNbs, payloads):
+        '''Append frames given as their numbers and concatenated payloads'''
+        if not self._frameNbs:
+            self._chunkTime = time()
+        self._frameNbs.extend(frameNbs)
+        self._payloads += payloads
+        if len(self._frameNbs) >= self._chunkFrames:
+            self.flush()
+
+    def flush(self):
+        count = len(self._frameNbs)
+        if not count:
+            return
+        self._index.append((self._frameNbs[0], self._chunkTime,
+                            self._io.tell()))
+        body = chunkHeader.pack(self._frameNbs[0], self._chunkTime, count)
+        body += Struct('<' + str(count) + 'Q').pack(*self._frameNbs)
+        self._writeRecord('CHNK', body + str(self._payloads))
+        self._frameNbs = []
+        self._payloads = bytearray()
+        self._io.flush()
+
+    def close(self):
+        if self._io.closed:
+            return
+        self.flush()
+        self._writeRecord('INDX', ''.join(indexEntry.pack(*e)
+                                          for e in self._index))
+        self._io.close()
+
+
+class FrameLogReader(object):
+    def __init__(self, logFile):
+        self._io = open(logFile, 'rb')
+        self._size = path.getsize(logFile)
+
+    def close(self):
+        self._io.close()
+
+    def _records(self, start=0):
+        offset = start
+        while offset + recordHeader.size <= self._size:
+            self._io.seek(offset)
+            tag, length = recordHeader.unpack(
+                self._io.read(recordHeader.size))
+            if tag not in ('DTSL', 'CHNK', 'INDX'):
+                raise FrameLogException('Corrupted log at offset ' +
+                                        str(offset))
+            if offset + recordHeader.size + length > self._size:
+                # Truncated trailing record
+                break
+            yield offset, tag, length
+            offset += recordHeader.size + length
+
+    def _body(self, offset, length):
+        self._io.seek(offset + recordHeader.size)
+        return self._io.read(length)
+
+    def sessions(self):
+        '''
+        Returns a list of (meta, index, offset) per session, offset being
+        the one of its header. The index is read from the INDX record, or
+        rebuilt from the chunk headers when missing.
+        '''
+        sessions = []
+        for offset, tag, length in self._records():
+            if tag == 'DTSL':
+                sessions.append([json.loads(self._body(offset, length)), [],
+                                 False, offset])
+            elif tag == 'INDX' and sessions:
+                body = self._body(offset, length)
+                sessions[-1][1] = [indexEntry.unpack_from(body, i)
+                                   for i in range(0, len(body),
+                                                  indexEntry.size)]
+                sessions[-1][2] = True
+            elif tag == 'CHNK' and sessions and not sessions[-1][2]:
+                self._io.seek(offset + recordHeader.size)
+                first, ts, count = chunkHeader.unpack(
+                    self._io.read(chunkHeader.size))
+                sessions[-1][1].append((first, ts, offset))
+        return [(meta, index, offset)
+                for meta, index, closed, offset in sessions]
+
+    def chunks(self, start=0, end=None):
+        '''
+        Stream the log from offset `start`, yielding ('session', meta) when
+        a new session begins and ('chunk', (timestamp, frameNbs, payloads)).
+        Chunks starting after frame `end` are skipped on their header,
+        without reading their body.
+        '''
+        for offset, tag, length in self._records(start):
+            if tag == 'DTSL':
+                yield 'session', json.loads(self._body(offset, length))
+            elif tag == 'CHNK':
+                self._io.seek(offset + recordHeader.size)
+                first, ts, count = chunkHeader.unpack(
+                    self._io.read(chunkHeader.size))
+                if end is not None and first > end:
+                    continue
+                body = self._body(offset, length)
+                frameNbs = Struct('<' + str(count) + 'Q').unpack_from(
+                    body, chunkHeader.size)
+                payloads = body[chunkHeader.size + 8 * count:]
+                yield 'chunk', (ts, frameNbs, payloads)
+
+    def seekFrame(self, frameNb, session=-1):
+        '''Offset of the chunk holding `frameNb` in the given session'''
+        return seekIndex(self.sessions()[session][1], frameNb)
+
+
+def seekIndex(index, frameNb):
+    '''
+    Offset of the chunk of a session index holding `frameNb` (its first
+    chunk if none), or None when the session has no chunk
+    '''
+    offset = None
+    for first, ts, chunkOffset in index:
+        if first > frameNb:
+            break
+        offset = chunkOffset
+    return offset if offset is not None else (index[0][2]
+                                              if index else None)
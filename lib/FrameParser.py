@@ -0,0 +1,128 @@
+'''
+DTS frame parser
+
+A frame is the start-of-frame marker 73 95 DB 42, the payload and a CRC-8
+computed over the marker and the payload. Bytes are fed in chunks as they
+are read; complete frames are extracted from the byte ring in bulk.
+
+A frame failing its CRC is taken for a false SOF: it is dropped and the
+search resumes from the byte following that SOF, so that a real frame
+starting inside the bad one is recovered. Every loss of synchronization,
+on noise or on a CRC failure, is recorded as a resync event with the
+stream offsets where synchronization was lost and found again.
+'''
+from lib.ByteRing import ByteRing
+from lib.CRC import CRC8
+from collections import deque
+from time import time
+
+SOF = '\x73\x95\xDB\x42'
+
+
+class FrameParser(object):
+    def __init__(self, dataSize, onCrcError=None, sof=SOF, onResync=None,
+                 maxEvents=1000):
+        self.sof = sof
+        self.dataSize = dataSize
+        self.frameSize = len(sof) + dataSize + 1
+        self.buffer = ByteRing()
+        self.frameNb = 0
+        self.crcFailNb = 0
+        self.resyncNb = 0
+        self.discardedBytes = 0
+        # Last resync events, as (lostOffset, foundOffset, reason)
+        self.resyncs = deque(maxlen=maxEvents)
+        self._onCrcError = onCrcError
+        self._onResync = onResync
+        self._lostAt = None
+        self._lostReason = None
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def feed(self, data):
+        self.buffer.write(data)
+
+    def clear(self):
+        self.buffer.clear()
+        self._lostAt = None
+
+    def _lose(self, offset, reason):
+        if self._lostAt is None:
+            self._lostAt = offset
+            self._lostReason = reason
+
+    def _found(self, offset):
+        event = (self._lostAt, offset, self._lostReason)
+        self._lostAt = None
+        self.resyncNb += 1
+        self.resyncs.append(event)
+        if self._onResync:
+            self._onResync(*event)
+
+    def frames(self):
+        '''
+        Extract every complete frame available in the buffer. Returns the
+        frame numbers and the payloads concatenated in a single bytearray.
+        Stream offsets are given by the number of bytes consumed so far.
+        '''
+        ring = self.buffer
+        sof = self.sof
+        keep = len(sof) - 1
+        frameSize = self.frameSize
+        crcSize = frameSize - 1
+        payloadStart = len(sof)
+        checkFrame = CRC8.checkFrame
+        frameNbs = []
+        payloads = bytearray()
+        while True:
+            idx = ring.find(sof)
+            if idx < 0:
+                # Keep a possible partial SOF at the end of the buffer
+                if len(ring) > keep:
+                    self._lose(ring.consumed, 'noise')
+                    self.discardedBytes += ring.consume(len(ring) - keep)
+                break
+            if idx:
+                self._lose(ring.consumed, 'noise')
+                self.discardedBytes += ring.consume(idx)
+            if self._lostAt is not None:
+                self._found(ring.consumed)
+            if len(ring) < frameSize:
+                break
+            buf = ring.buffer
+            start = ring.start
+            if not checkFrame(buf, start, crcSize):
+                # Rescan from the byte after the false SOF
+                self.crcFailNb += 1
+                offset = ring.consumed
+                self._lose(offset, 'crc')
+                self.discardedBytes += ring.consume(1)
+                if self._onCrcError:
+                    self._onCrcError(self.crcFailNb, offset)
+                continue
+            self.frameNb += 1
+            payloads += buf[start + payloadStart:start + crcSize]
+            frameNbs.append(self.frameNb)
+            ring.consume(frameSize)
+        return frameNbs, payloads
+
+
+class ErrorBudget(object):
+    '''
+    At most `count` errors within any `window` seconds. A null count never
+    runs out.
+    '''
+    def __init__(self, count=10, window=1.):
+        self.count = count
+        self.window = window
+        self._times = deque(maxlen=max(1, count))
+
+    def add(self, t=None):
+        '''Record an error, returning False once the budget is exhausted'''
+        if not self.count:
+            return True
+        t = time() if t is None else t
+        self._times.append(t)
+        return len(self._times) < self.count or \
+            t - self._times[0] > self.window
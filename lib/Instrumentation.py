@@ -0,0 +1,171 @@
+'''
+Pipeline instrumentation
+
+Counters and log2-bucketed histograms for the acquisition pipeline, with a
+one-line summary, a JSON dump and an on-demand dump on a signal. Bounded
+measurements that need exact percentiles keep their samples instead.
+'''
+from array import array
+from time import time
+import signal
+import json
+
+
+class Histogram(object):
+    '''
+    Histogram with power of two buckets: bucket i counts the values in
+    [2^(i-1), 2^i), bucket 0 counts the values lower than 1.
+    '''
+    def __init__(self, unit=''):
+        self.unit = unit
+        self.buckets = [0] * 64
+        self.count = 0
+        self.total = 0.
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        self.buckets[min(int(value).bit_length() if value >= 1 else 0, 63)] += 1
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.
+
+    def percentile(self, p):
+        '''Upper bound of the bucket holding the p-th percentile'''
+        if not self.count:
+            return 0
+        rank = p / 100. * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= rank:
+                return min(1 << i, self.max) if i else min(1, self.max)
+        return self.max
+
+    def toDict(self):
+        return {'unit': self.unit, 'count': self.count, 'mean': self.mean,
+                'min': self.min, 'max': self.max,
+                'p50': self.percentile(50), 'p99': self.percentile(99),
+                'buckets': dict(((1 << i) if i else 1, n)
+                                for i, n in enumerate(self.buckets) if n)}
+
+
+class Samples(object):
+    '''
+    Same interface as Histogram, keeping the values for exact (nearest
+    rank) percentiles. Without a `capacity` every value is kept, for bounded
+    runs; otherwise the statistics are those of the last `capacity` values,
+    kept in a circular array. `count` is the number of values added.
+    '''
+    def __init__(self, unit='', capacity=None):
+        self.unit = unit
+        self.values = array('d')
+        self.count = 0
+        self._capacity = capacity
+        self._sorted = None
+
+    def add(self, value):
+        if self._capacity and self.count >= self._capacity:
+            self.values[self.count % self._capacity] = value
+        else:
+            self.values.append(value)
+        self.count += 1
+        self._sorted = None
+
+    @property
+    def mean(self):
+        return sum(self.values) / len(self.values) if self.values else 0.
+
+    @property
+    def min(self):
+        return min(self.values) if self.values else None
+
+    @property
+    def max(self):
+        return max(self.values) if self.values else None
+
+    def percentile(self, p):
+        if not self.values:
+            return 0
+        if self._sorted is None:
+            self._sorted = sorted(self.values)
+        rank = int(-(-p * len(self._sorted) // 100))
+        return self._sorted[min(max(rank, 1), len(self._sorted)) - 1]
+
+    def toDict(self):
+        return {'unit': self.unit, 'count': self.count, 'mean': self.mean,
+                'min': self.min, 'max': self.max,
+                'p50': self.percentile(50), 'p90': self.percentile(90),
+                'p99': self.percentile(99)}
+
+
+class PipelineStats(object):
+    COUNTERS = ('reads', 'bytesRead', 'frames', 'sofResyncs',
+                'discardedBytes', 'crcFailures', 'overflows', 'droppedBytes')
+    HISTOGRAMS = (('readSize', 'bytes'), ('readLatency', 'us'),
+                  ('queueWait', 'us'), ('decodeTime', 'us'),
+                  ('sinkTime', 'us'))
+
+    def __init__(self):
+        self.start = time()
+        self._last = self.start
+        self._lastFrames = 0
+        self._lastBytes = 0
+        self._dumpRequested = False
+        for name in self.COUNTERS:
+            setattr(self, name, 0)
+        # (lostOffset, foundOffset, reason) of the last resyncs
+        self.resyncEvents = []
+        self.histograms = dict((name, Histogram(unit))
+                               for name, unit in self.HISTOGRAMS)
+
+    def toDict(self):
+        d = dict((name, getattr(self, name)) for name in self.COUNTERS)
+        d['elapsed'] = time() - self.start
+        d['resyncEvents'] = self.resyncEvents
+        d['histograms'] = dict((name, h.toDict())
+                               for name, h in self.histograms.items())
+        return d
+
+    def line(self):
+        '''Summary of the period since the previous call'''
+        now = time()
+        elapsed = max(now - self._last, 1e-9)
+        fps = (self.frames - self._lastFrames) / elapsed
+        bps = (self.bytesRead - self._lastBytes) / elapsed
+        self._last, self._lastFrames = now, self.frames
+        self._lastBytes = self.bytesRead
+        h = self.histograms
+        return ('[stats] {0:.0f} frames/s {1:.0f} B/s | read {2:.0f} B '
+                'p99 {3:.0f} us | resync {4} discarded {5} B | CRC {6} | '
+                'overflow {7} | decode p99 {8:.0f} us | sink p99 {9:.0f} us'
+                ).format(
+            fps, bps, h['readSize'].mean, h['readLatency'].percentile(99),
+            self.sofResyncs, self.discardedBytes, self.crcFailures,
+            self.overflows, h['decodeTime'].percentile(99),
+            h['sinkTime'].percentile(99)) + (
+            ' | queue wait p99 {0:.0f} us'.format(
+                h['queueWait'].percentile(99))
+            if h['queueWait'].count else '')
+
+    def dumpJson(self, statsFile):
+        with open(statsFile, 'w') as f:
+            json.dump(self.toDict(), f, indent=2, sort_keys=True)
+
+    def installSignal(self, signum=signal.SIGUSR1):
+        '''Request a dump when `signum` is received, see dumpRequested()'''
+        def handler(signum, frame):
+            self._dumpRequested = True
+        signal.signal(signum, handler)
+
+    def dumpRequested(self):
+        requested = self._dumpRequested
+        self._dumpRequested = False
+        return requested
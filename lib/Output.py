@@ -1,4 +1,8 @@
 from sys import stdout
+from threading import Thread, Lock, Condition
+from collections import deque
+from time import time
+from binascii import hexlify
 
 '''
 Buffered stream to unbuffered
@@ -20,33 +24,208 @@ class UnbufferedStreamWrapper(object):
         self._stream.write('\n')
         self._stream.flush()
 
+    def close(self):
+        # The wrapped stream is not owned by the wrapper
+        self._stream.flush()
+
+    def __getattr__(self, attr):
+        return getattr(self._stream, attr)
+
+
+'''
+Coalescing output
+
+Same interface as UnbufferedStreamWrapper, but writes are gathered and
+flushed to the stream when `maxSize` bytes are pending or when the oldest
+pending write is `maxDelay` seconds old, whichever comes first. A
+background thread enforces the deadline, so the output still looks live.
+
+With `maxPending` set, writes never block the caller: the flusher thread
+does all the stream writes and, when the stream can't keep up, the oldest
+pending writes are dropped so that at most `maxPending` bytes are queued.
+'''
+
+class CoalescingStreamWrapper(object):
+    def __init__(self, stream, maxSize=65536, maxDelay=.05, maxPending=0):
+        if not type(stream) is file:
+            raise AttributeError('Cannot construct Wrapper with object ' +
+                                 str(type(stream)))
+        self._stream = stream
+        self._maxSize = maxSize
+        self._maxDelay = maxDelay
+        self._maxPending = maxPending
+        self._pending = deque()
+        self._size = 0
+        self._since = 0.
+        self._lock = Lock()
+        self._writeLock = Lock()
+        self._wakeup = Condition(self._lock)
+        self._closed = False
+        self.droppedWrites = 0
+        self.droppedBytes = 0
+        self._flusher = Thread(target=self._flushLoop, name='output')
+        self._flusher.daemon = True
+        self._flusher.start()
+
+    def _flushLoop(self):
+        while True:
+            with self._lock:
+                if self._closed:
+                    return
+                if self._size >= self._maxSize:
+                    timeout = 0
+                elif self._size:
+                    timeout = self._since + self._maxDelay - time()
+                else:
+                    timeout = None
+                if timeout is None or timeout > 0:
+                    # Wake up at least every maxDelay to stay responsive
+                    self._wakeup.wait(timeout or self._maxDelay)
+                    continue
+            self.flush()
+
+    def write(self, data):
+        if not len(data):
+            return
+        with self._lock:
+            if not self._size:
+                self._since = time()
+            self._pending.append(data)
+            self._size += len(data)
+            if self._maxPending:
+                while self._size > self._maxPending and \
+                        len(self._pending) > 1:
+                    dropped = self._pending.popleft()
+                    self._size -= len(dropped)
+                    self.droppedWrites += 1
+                    self.droppedBytes += len(dropped)
+            full = self._size >= self._maxSize
+            if full and self._maxPending:
+                self._wakeup.notify()
+        if full and not self._maxPending:
+            self.flush()
+
+    def writeln(self, data):
+        self.write(data + '\n')
+
+    def flush(self):
+        with self._writeLock:
+            with self._lock:
+                data = ''.join(self._pending)
+                self._pending.clear()
+                self._size = 0
+            if len(data):
+                self._stream.write(data)
+            self._stream.flush()
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify()
+
     def __getattr__(self, attr):
         return getattr(self._stream, attr)
 
 
+def addOutputArguments(p):
+    p.add_argument('--output-delay',
+                   type=float,
+                   default=50.,
+                   metavar='MS',
+                   help='Flush terminal output at least every MS \
+                       milliseconds (0 to flush every write)')
+
+    p.add_argument('--drop-output',
+                   type=int,
+                   default=0,
+                   metavar='KB',
+                   help='Never block on a slow terminal: drop the oldest \
+                       output beyond KB kilobytes pending')
+
+
+def openOutput(a, stream=stdout):
+    delay = getattr(a, 'output_delay', 50.)
+    if not delay:
+        return UnbufferedStreamWrapper(stream)
+    return CoalescingStreamWrapper(stream, maxDelay=delay / 1000.,
+                                   maxPending=getattr(a, 'drop_output',
+                                                      0) * 1024)
+
+
+def rawHex(buf, group=2):
+    '''Bytes as zero-padded hex, with a ':' after every `group` bytes'''
+    h = hexlify(buf)
+    g = 2 * group
+    return ':'.join([h[i:i + g] for i in xrange(0, len(h), g)]) + ':'
+
+
 '''
 Hexdump formatted output
+
+The translation table and the line formats are built once; each write()
+formats all of its lines with one '%' per line and issues a single write.
+The offset keeps running across calls and a partial last line is held
+back until the next write() completes it, so a stream of chunks of any size
+is dumped as one continuous stream. flush() prints the pending bytes; live
+dumps call it when the line goes idle, so the end of a burst is not hidden
+until more traffic arrives.
 '''
-    
+
 class Hexdump:
     def __init__(self, stream=stdout, length=16, sep='.'):
         self._length = length
         self._sep = sep
         self._out = stream
+        self._offset = 0
+        self._pending = bytearray()
+        self._filter = ''.join([(len(repr(chr(x))) == 3) and chr(x) or
+                                sep for x in range(256)])
+        self._formats = {}
+
+    def _format(self, n):
+        fmt = self._formats.get(n)
+        if fmt is None:
+            h = ' '.join(['%02x'] * min(n, 8))
+            if n > 8:
+                h += '  ' + ' '.join(['%02x'] * (n - 8))
+            width = 3 * n - 1 + (n > 8)
+            fmt = '%08x:  ' + h + ' ' * max(0, self._length * 3 - width) + \
+                '  |%s|\n'
+            self._formats[n] = fmt
+        return fmt
+
+    def reset(self, offset=0):
+        self._offset = offset
+        self._pending = bytearray()
 
     def write(self, src):
-        FILTER = ''.join([(len(repr(chr(x))) == 3) and chr(x) or
-                         self._sep for x in range(256)])
-        for c in xrange(0, len(src), self._length):
-            chars = src[c:c+self._length]
-            h = ' '.join(["%02x" % ord(x) for x in chars])
-            if len(h) > 24:
-                h = "%s %s" % (h[:24], h[24:])
-            printable = ''.join(["%s" % ((ord(x) <= 127 and FILTER[ord(x)]) or
-                                self._sep) for x in chars])
-            self._out.write("%08x:  %-*s  |%s|\n" %
-                            (c, self._length*3, h, printable))
+        data = self._pending + bytearray(src)
+        end = len(data) - len(data) % self._length
+        self._pending = data[end:]
+        self._dump(data[:end])
+
+    def flush(self):
+        data, self._pending = self._pending, bytearray()
+        self._dump(data)
+
+    def _dump(self, data):
+        if not len(data):
+            return
+        length = self._length
+        printable = str(data).translate(self._filter)
+        full = self._format(length)
+        lines = []
+        for c in xrange(0, len(data), length):
+            n = min(length, len(data) - c)
+            fmt = full if n == length else self._format(n)
+            lines.append(fmt % ((self._offset + c,) +
+                                tuple(data[c:c + length]) +
+                                (printable[c:c + length],)))
+        self._offset += len(data)
+        self._out.write(''.join(lines))
 
 if __name__ == '__main__':
     h = Hexdump()
     h.write('test')
+    h.flush()
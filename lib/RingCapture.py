@@ -0,0 +1,159 @@
+'''
+Bounded circular capture file
+
+A fixed-size, memory-mapped file always holding the last chunks read from
+the bus. The file starts with a header page followed by the data area:
+    header: 'FTDIRING' | capacity | head | tail | records (uint64)
+            | total bytes (uint64) | frozen (uint32) | trigger time (double)
+            | baudrate (uint32)
+    record: 'CHNK' | receive time (double) | length (uint32) | data
+Records never straddle the end of the data area: a 'WRAP' marker (or less
+than a record header of free space) sends the reader back to offset 0.
+When the ring is full, the oldest records are evicted to make room. Once
+frozen, the ring is no longer written and can be extracted at leisure.
+'''
+from struct import Struct
+from time import time
+from os import path
+import mmap
+
+RING_MAGIC = 'FTDIRING'
+HEADER_SIZE = 4096
+ringHeader = Struct('<8sQQQQQIdI')
+recordHeader = Struct('<4sdI')
+
+
+class RingCaptureException(Exception):
+    pass
+
+
+class RingCapture(object):
+    def __init__(self, ringFile, capacity=None, baudrate=0):
+        '''
+        With `capacity` (bytes), create a new ring file; otherwise open an
+        existing one.
+        '''
+        if capacity is not None:
+            if capacity < 2 * recordHeader.size:
+                raise RingCaptureException('Ring capacity too small')
+            with open(ringFile, 'wb') as f:
+                f.truncate(HEADER_SIZE + capacity)
+        self._file = open(ringFile, 'r+b')
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        if capacity is not None:
+            self.capacity = capacity
+            self.head = self.tail = self.records = self.totalBytes = 0
+            self.frozen = False
+            self.triggerTime = 0.
+            self.baudrate = baudrate
+            self._sync()
+        else:
+            self._load()
+
+    def _load(self):
+        (magic, self.capacity, self.head, self.tail, self.records,
+         self.totalBytes, frozen, self.triggerTime,
+         self.baudrate) = ringHeader.unpack_from(self._map, 0)
+        if magic != RING_MAGIC or \
+                len(self._map) != HEADER_SIZE + self.capacity:
+            raise RingCaptureException('Not a ring capture file')
+        self.frozen = bool(frozen)
+
+    def _sync(self):
+        ringHeader.pack_into(self._map, 0, RING_MAGIC, self.capacity,
+                             self.head, self.tail, self.records,
+                             self.totalBytes, int(self.frozen),
+                             self.triggerTime, self.baudrate)
+
+    def _evict(self):
+        '''Drop the oldest record, following a wrap marker if needed'''
+        while True:
+            if self.tail + recordHeader.size > self.capacity:
+                self.tail = 0
+                continue
+            tag, ts, length = recordHeader.unpack_from(
+                self._map, HEADER_SIZE + self.tail)
+            if tag == 'WRAP':
+                self.tail = 0
+                continue
+            self.tail += recordHeader.size + length
+            self.records -= 1
+            return
+
+    def write(self, data, ts=None):
+        if self.frozen or not len(data):
+            return
+        ts = time() if ts is None else ts
+        maxData = self.capacity - recordHeader.size
+        for i in xrange(0, len(data), maxData):
+            self._writeRecord(data[i:i + maxData], ts)
+        self._sync()
+
+    def _writeRecord(self, data, ts):
+        n = recordHeader.size + len(data)
+        if self.head + n > self.capacity:
+            # Everything from head to the end is either free or oldest data
+            while self.records and self.tail >= self.head:
+                self._evict()
+            if self.head + recordHeader.size <= self.capacity:
+                recordHeader.pack_into(self._map, HEADER_SIZE + self.head,
+                                       'WRAP', ts, 0)
+            self.head = 0
+        while self.records and self.head <= self.tail < self.head + n:
+            self._evict()
+        if not self.records:
+            self.tail = self.head
+        offset = HEADER_SIZE + self.head
+        recordHeader.pack_into(self._map, offset, 'CHNK', ts, len(data))
+        self._map[offset + recordHeader.size:offset + n] = data
+        self.head += n
+        self.records += 1
+        self.totalBytes += len(data)
+
+    def freeze(self, triggerTime=None):
+        self.frozen = True
+        self.triggerTime = time() if triggerTime is None else triggerTime
+        self._sync()
+        self._map.flush()
+
+    def chunks(self, start=None, end=None, withData=True):
+        '''
+        Walk the records from the oldest one, yielding (time, data) for the
+        chunks received between `start` and `end`. Only the record headers
+        are read for the chunks out of the window.
+        '''
+        offset = self.tail
+        remaining = self.records
+        while remaining:
+            if offset + recordHeader.size > self.capacity:
+                offset = 0
+                continue
+            pos = HEADER_SIZE + offset
+            tag, ts, length = recordHeader.unpack_from(self._map, pos)
+            if tag == 'WRAP':
+                offset = 0
+                continue
+            if tag != 'CHNK':
+                raise RingCaptureException('Corrupted ring at offset ' +
+                                           str(offset))
+            remaining -= 1
+            offset += recordHeader.size + length
+            if end is not None and ts > end:
+                break
+            if start is not None and ts < start:
+                continue
+            pos += recordHeader.size
+            yield ts, (self._map[pos:pos + length] if withData else length)
+
+    def close(self):
+        if not self._file.closed:
+            self._map.flush()
+            self._map.close()
+            self._file.close()
+
+
+def isRingFile(ringFile):
+    if not path.exists(ringFile):
+        return False
+    with open(ringFile, 'rb') as f:
+        return f.read(len(RING_MAGIC)) == RING_MAGIC
@@ -0,0 +1,92 @@
+'''
+Bulk SPI transfers
+
+Payloads are sent in large chunks, either all within a single chip-select
+assertion or with one Start()/Write()/Stop() transaction per chunk, so
+that the per-transaction MPSSE overhead is paid per chunk instead of per
+couple of bytes.
+'''
+from random import Random
+from time import time
+
+PATTERNS = ('alpha', 'counter', 'zeros', 'ones', 'random')
+
+
+def makePattern(name, size, seed=0):
+    '''`size` bytes of the generator pattern `name`'''
+    if name == 'alpha':
+        unit = ''.join(chr(c) for c in range(ord('A'), ord('z') + 1))
+    elif name == 'counter':
+        unit = ''.join(chr(c) for c in range(256))
+    elif name == 'zeros':
+        unit = '\x00'
+    elif name == 'ones':
+        unit = '\xff'
+    elif name == 'random':
+        rnd = Random(seed)
+        return str(bytearray(rnd.getrandbits(8) for i in xrange(size)))
+    else:
+        raise ValueError('Unknown pattern \'' + name + '\'')
+    return (unit * (size // len(unit) + 1))[:size]
+
+
+def chunked(payload, chunkSize):
+    for i in xrange(0, len(payload), chunkSize):
+        yield payload[i:i + chunkSize]
+
+
+def streamChunks(stream, chunkSize):
+    '''Chunks read from a file-like object until its end'''
+    return iter(lambda: stream.read(chunkSize), '')
+
+
+class BulkTransfer(object):
+    def __init__(self, mpsse, framed=False):
+        self._m = mpsse
+        self._framed = framed
+        self.bytes = 0
+        self.chunks = 0
+        self.elapsed = 0.
+        # Read when the transfer starts, the device may be closed by the
+        # time the rates are reported
+        self.clock = 0
+
+    @property
+    def theoreticalRate(self):
+        '''Bytes/s of a bus clocked continuously at the transfer clock'''
+        return self.clock / 8.
+    @property
+    def rate(self):
+        return self.bytes / self.elapsed if self.elapsed else 0.
+
+    @property
+    def efficiency(self):
+        return self.rate / self.theoreticalRate if self.clock else 0.
+
+    def send(self, chunks, progress=None):
+        '''
+        Send every chunk of the `chunks` iterable, calling
+        progress(transfer) after each one.
+        '''
+        m = self._m
+        self.clock = m.GetClock()
+        start = time()
+        if not self._framed:
+            m.Start()
+        try:
+            for chunk in chunks:
+                if self._framed:
+                    m.Start()
+                    m.Write(chunk)
+                    m.Stop()
+                else:
+                    m.Write(chunk)
+                self.bytes += len(chunk)
+                self.chunks += 1
+                self.elapsed = time() - start
+                if progress:
+                    progress(self)
+        finally:
+            if not self._framed:
+                m.Stop()
+            self.elapsed = time() - start
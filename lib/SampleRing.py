@@ -0,0 +1,54 @@
+'''
+Sample history
+
+A fixed number of (timestamp, value) samples held in two preallocated
+arrays of doubles: appending overwrites the oldest sample and allocates
+nothing, so a long sampling session runs in bounded memory. Values that
+are not numbers are stored as NaN.
+'''
+from array import array
+
+NAN = float('nan')
+
+
+class SampleRing(object):
+    def __init__(self, capacity=3600):
+        self.capacity = capacity
+        self.times = array('d', [0.]) * capacity
+        self.values = array('d', [0.]) * capacity
+        self._next = 0
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, ts, value):
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            value = NAN
+        i = self._next
+        self.times[i] = ts
+        self.values[i] = value
+        self._next = i + 1 if i + 1 < self.capacity else 0
+        self.count += 1
+
+    def last(self):
+        if not self.count:
+            return None
+        i = self._next - 1 if self._next else self.capacity - 1
+        return self.times[i], self.values[i]
+
+    def samples(self):
+        '''(times, values) arrays, oldest sample first'''
+        if self.count <= self.capacity:
+            return self.times[:self.count], self.values[:self.count]
+        i = self._next
+        return (self.times[i:] + self.times[:i],
+                self.values[i:] + self.values[:i])
+
+    def changes(self):
+        '''Number of value changes in the history'''
+        times, values = self.samples()
+        return sum(1 for a, b in zip(values, values[1:])
+                   if a != b and (a == a or b == b))
@@ -0,0 +1,98 @@
+'''
+Running statistics
+
+Constant memory min/max/mean/standard deviation (Welford's algorithm).
+Batches are merged with the pairwise formula of Chan et al., which is
+vectorized when the batch is a NumPy array.
+'''
+from math import sqrt
+
+
+class RunningStats(object):
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.mean = 0.
+        self.min = None
+        self.max = None
+        self._m2 = 0.
+
+    def update(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / float(self.count)
+        self._m2 += delta * (x - self.mean)
+        if self.min is None or x < self.min:
+            self.min = x
+        if self.max is None or x > self.max:
+            self.max = x
+
+    def updateBatch(self, values):
+        n = len(values)
+        if not n:
+            return
+        if hasattr(values, 'mean'):
+            mean = float(values.mean())
+            m2 = float(((values - mean) ** 2).sum())
+            vMin, vMax = values.min().item(), values.max().item()
+        else:
+            mean = sum(values) / float(n)
+            m2 = sum((v - mean) ** 2 for v in values)
+            vMin, vMax = min(values), max(values)
+        total = self.count + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self._m2 += m2 + delta * delta * self.count * n / total
+        self.count = total
+        if self.min is None or vMin < self.min:
+            self.min = vMin
+        if self.max is None or vMax > self.max:
+            self.max = vMax
+
+    @property
+    def variance(self):
+        return self._m2 / self.count if self.count else 0.
+
+    @property
+    def stddev(self):
+        return sqrt(self.variance)
+
+
+class MinMaxEnvelope(object):
+    '''
+    Min/max envelope of a series, decimated on the fly to at most
+    `maxPoints` buckets: when the buckets are full, neighbours are merged
+    and the bucket width doubles, so one pass over a series of unknown
+    length runs in bounded memory.
+    '''
+    def __init__(self, maxPoints=1000, width=1):
+        self.maxPoints = max(2, maxPoints & ~1)
+        self.width = width
+        self.buckets = []
+        self._fill = 0
+
+    def update(self, key, value):
+        '''Add `value`, `key` (e.g. a frame number) marks bucket starts'''
+        if self._fill:
+            b = self.buckets[-1]
+            if value < b[1]:
+                b[1] = value
+            if value > b[2]:
+                b[2] = value
+        else:
+            if len(self.buckets) == self.maxPoints:
+                self._merge()
+                return self.update(key, value)
+            self.buckets.append([key, value, value])
+        self._fill += 1
+        if self._fill >= self.width:
+            self._fill = 0
+
+    def _merge(self):
+        b = self.buckets
+        self.buckets = [[b[i][0], min(b[i][1], b[i + 1][1]),
+                         max(b[i][2], b[i + 1][2])]
+                        for i in xrange(0, len(b), 2)]
+        self.width *= 2
@@ -0,0 +1,238 @@
+'''
+Frame triggers
+
+A trigger is a Python expression over the descriptor labels, e.g.
+    current > 500 or abs(encoderPos - prev_encoderPos) > 100
+Array items are written name[i], `prev_<label>` is the value of the label
+in the previous frame, and abs, min and max are available. The expression
+is checked and compiled once into a function scanning a whole batch of
+decoded rows, with the labels bound to local variables.
+
+TriggerGate only lets through the frames around the matches: the last
+`pre` frames are kept in a preallocated ring and released when the
+trigger fires, then `post` frames are let through after every match.
+'''
+from array import array
+import ast
+import re
+
+FUNCTIONS = ('abs', 'min', 'max')
+_operators = {
+    ast.Add: '+', ast.Sub: '-', ast.Mult: '*', ast.Div: '/', ast.Mod: '%',
+    ast.Pow: '**', ast.BitAnd: '&', ast.BitOr: '|', ast.BitXor: '^',
+    ast.LShift: '<<', ast.RShift: '>>', ast.FloorDiv: '//',
+    ast.USub: '-', ast.UAdd: '+', ast.Not: 'not ', ast.Invert: '~',
+    ast.And: ' and ', ast.Or: ' or ',
+    ast.Eq: '==', ast.NotEq: '!=', ast.Lt: '<', ast.LtE: '<=', ast.Gt: '>',
+    ast.GtE: '>='}
+_arrayRgx = re.compile(r'^(\w+)\[([0-9]+)\]$')
+
+
+class TriggerException(Exception):
+    def __init__(self, sender, msg):
+        self.sender = sender
+        self.msg = msg
+
+    def __str__(self):
+        return repr(self.msg)
+
+
+class _Translator(object):
+    '''Check an expression tree and write it back over local variables'''
+    def __init__(self, labels):
+        self._index = dict((l, i) for i, l in enumerate(labels))
+        self.used = set()
+        self.prevUsed = set()
+
+    def _fail(self, msg):
+        raise TriggerException('trigger', msg)
+
+    def _label(self, name):
+        prev = name.startswith('prev_') and name not in self._index
+        label = name[len('prev_'):] if prev else name
+        if label not in self._index:
+            self._fail('Unknown label \'' + label + '\'')
+        i = self._index[label]
+        if prev:
+            self.prevUsed.add(i)
+            return '_p' + str(i)
+        self.used.add(i)
+        return '_v' + str(i)
+
+    def visit(self, node):
+        if isinstance(node, ast.BoolOp):
+            return '(' + _operators[type(node.op)].join(
+                self.visit(v) for v in node.values) + ')'
+        if isinstance(node, ast.BinOp) and type(node.op) in _operators:
+            return '(' + self.visit(node.left) + _operators[type(node.op)] + \
+                self.visit(node.right) + ')'
+        if isinstance(node, ast.UnaryOp) and type(node.op) in _operators:
+            return '(' + _operators[type(node.op)] + \
+                self.visit(node.operand) + ')'
+        if isinstance(node, ast.Compare) and \
+                all(type(op) in _operators for op in node.ops):
+            return '(' + self.visit(node.left) + ''.join(
+                _operators[type(op)] + self.visit(c)
+                for op, c in zip(node.ops, node.comparators)) + ')'
+        if isinstance(node, ast.Num):
+            return repr(node.n)
+        if isinstance(node, ast.Name):
+            if node.id in ('True', 'False'):
+                return node.id
+            return self._label(node.id)
+        if isinstance(node, ast.Subscript) and \
+                isinstance(node.value, ast.Name) and \
+                isinstance(node.slice, ast.Index) and \
+                isinstance(node.slice.value, ast.Num):
+            return self._label('{0}[{1}]'.format(node.value.id,
+                                                 node.slice.value.n))
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) \
+                and node.func.id in FUNCTIONS and not node.keywords and \
+                not node.starargs and not node.kwargs:
+            return node.func.id + '(' + ', '.join(
+                self.visit(a) for a in node.args) + ')'
+        self._fail('Unsupported expression: ' + type(node).__name__)
+
+
+def compileTrigger(expression, labels):
+    '''
+    Compile `expression` into scan(rows, prev) returning the indexes of the
+    matching rows; `prev` is the row preceding the batch (or None).
+    '''
+    try:
+        tree = ast.parse(expression.strip(), '<trigger>', 'eval')
+    except SyntaxError as e:
+        raise TriggerException('trigger', 'Invalid expression: ' + e.msg)
+    # 'name[i]' labels are array items, reachable as subscripts
+    for l in labels:
+        if not _arrayRgx.match(l) and not re.match(r'^[A-Za-z_]\w*$', l):
+            raise TriggerException('trigger', 'Label \'' + l + '\' cannot ' +
+                                   'be used in an expression')
+    t = _Translator(labels)
+    condition = t.visit(tree.body)
+    lines = ['def scan(rows, prev):',
+             '    hits = []',
+             '    append = hits.append',
+             '    if prev is None:',
+             '        prev = rows[0]']
+    lines += ['    _p{0} = prev[{0}]'.format(i) for i in sorted(t.prevUsed)]
+    lines += ['    for i, row in enumerate(rows):']
+    lines += ['        _v{0} = row[{0}]'.format(i)
+              for i in sorted(t.used | t.prevUsed)]
+    lines += ['        if ' + condition + ':',
+              '            append(i)']
+    lines += ['        _p{0} = _v{0}'.format(i) for i in sorted(t.prevUsed)]
+    lines += ['    return hits']
+    scope = dict((f, __builtins__[f] if isinstance(__builtins__, dict)
+                  else getattr(__builtins__, f)) for f in FUNCTIONS)
+    exec compile('\n'.join(lines) + '\n', '<trigger>', 'exec') in scope
+    return scope['scan']
+
+
+class FrameRing(object):
+    '''The last `capacity` frames, as frame numbers and raw payloads'''
+    def __init__(self, capacity, dataSize):
+        self.capacity = capacity
+        self._dataSize = dataSize
+        self._frameNbs = array('L', [0]) * capacity
+        self._payloads = bytearray(capacity * dataSize)
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def extend(self, frameNbs, payloads):
+        n = len(frameNbs)
+        if not n or not self.capacity:
+            return
+        size = self._dataSize
+        if n > self.capacity:
+            frameNbs = frameNbs[n - self.capacity:]
+            payloads = payloads[(n - self.capacity) * size:]
+            n = self.capacity
+        i = self._next
+        first = min(n, self.capacity - i)
+        self._frameNbs[i:i + first] = array('L', frameNbs[:first])
+        self._payloads[i * size:(i + first) * size] = payloads[:first * size]
+        if first < n:
+            self._frameNbs[:n - first] = array('L', frameNbs[first:])
+            self._payloads[:(n - first) * size] = payloads[first * size:]
+        self._next = (i + n) % self.capacity
+        self._count = min(self.capacity, self._count + n)
+
+    def drain(self):
+        '''Remove all the frames, returning (frameNbs, payloads)'''
+        size = self._dataSize
+        start = (self._next - self._count) % self.capacity \
+            if self.capacity else 0
+        end = start + self._count
+        if end <= self.capacity:
+            frameNbs = self._frameNbs[start:end].tolist()
+            payloads = self._payloads[start * size:end * size]
+        else:
+            end -= self.capacity
+            frameNbs = (self._frameNbs[start:] +
+                        self._frameNbs[:end]).tolist()
+            payloads = self._payloads[start * size:] + \
+                self._payloads[:end * size]
+        self._count = 0
+        return frameNbs, payloads
+
+
+class TriggerGate(object):
+    def __init__(self, expression, labels, dataSize, pre=100, post=100):
+        self._scan = compileTrigger(expression, labels)
+        self._dataSize = dataSize
+        self._post = post
+        self._ring = FrameRing(pre, dataSize)
+        self._remaining = 0
+        self._prev = None
+        self.triggers = 0
+        self.lastTrigger = None
+
+    def select(self, frameNbs, payloads, rows, decode):
+        '''
+        Keep the frames around the matches of a decoded batch. `decode`
+        turns ring payloads back into rows. Returns (frameNbs, payloads,
+        rows) of the frames to output, oldest first.
+        '''
+        if not rows:
+            return [], bytearray(), []
+        hits = self._scan(rows, self._prev)
+        self._prev = rows[-1]
+        size = self._dataSize
+        outNbs, outPayloads, outRows = [], bytearray(), []
+        n = len(frameNbs)
+        h = 0
+        i = 0
+        while i < n:
+            if self._remaining:
+                end = i + self._remaining
+                # Matches within the window extend it
+                while h < len(hits) and hits[h] < min(end, n):
+                    end = max(end, hits[h] + self._post + 1)
+                    h += 1
+                j = min(end, n)
+                outNbs.extend(frameNbs[i:j])
+                outPayloads += payloads[i * size:j * size]
+                outRows.extend(rows[i:j])
+                self._remaining = end - j
+                i = j
+                continue
+            while h < len(hits) and hits[h] < i:
+                h += 1
+            if h == len(hits):
+                self._ring.extend(frameNbs[i:], payloads[i * size:])
+                break
+            k = hits[h]
+            self._ring.extend(frameNbs[i:k], payloads[i * size:k * size])
+            preNbs, prePayloads = self._ring.drain()
+            outNbs.extend(preNbs)
+            outPayloads += prePayloads
+            outRows.extend(decode(prePayloads))
+            self.triggers += 1
+            self.lastTrigger = frameNbs[k]
+            self._remaining = self._post + 1
+            i = k
+        return outNbs, outPayloads, outRows
@@ -0,0 +1,119 @@
+'''
+BoardMemoryMonitor against the local ALMemory stand-in
+'''
+from StringIO import StringIO
+from argparse import Namespace
+from tempfile import TemporaryFile
+from time import time
+import sys
+import unittest
+
+import BoardMemoryMonitor as monitor
+from lib.FakeMemory import FakeALMemory
+
+BOARDS = ['ZeBoard', 'LFootBoard']
+KEYS = ['Error', 'Ack', 'Temperature']
+
+
+class RecordingMemory(FakeALMemory):
+    '''Records the (time, number of keys) of every getListData call'''
+    def __init__(self):
+        FakeALMemory.__init__(self, BOARDS, seed=0)
+        self.reads = []
+
+    def getListData(self, keys):
+        self.reads.append((time(), len(keys)))
+        return FakeALMemory.getListData(self, keys)
+
+    def watchedReads(self):
+        return [t for t, n in self.reads if n == len(BOARDS) * len(KEYS)]
+
+
+class UnsubscribableMemory(RecordingMemory):
+    def subscribeToMicroEvent(self, name, module, message, method):
+        raise RuntimeError('\tALMemory::subscribeToMicroEvent\n\t' +
+                           'Micro events are not available')
+
+
+class BurstMemory(FakeALMemory):
+    '''
+    Only updated by `burst` updates on the first read of the subscribed
+    keys, so that every notification is queued before being processed
+    '''
+    def __init__(self, burst):
+        FakeALMemory.__init__(self, BOARDS, seed=0)
+        self.tickOnCall = False
+        self._burst = burst
+
+    def getListData(self, keys):
+        if any(self._subscribers.values()):
+            for n in range(self._burst):
+                self.tick()
+            self._burst = 0
+        return FakeALMemory.getListData(self, keys)
+
+
+def arguments(**kwargs):
+    args = Namespace(rate=0., key=KEYS, board=BOARDS, all_boards=False,
+                     events=False, fake=False, fake_latency=0., log='',
+                     cycles=0)
+    for name, value in kwargs.items():
+        setattr(args, name, value)
+    return args
+
+
+class BoardMemoryMonitorTest(unittest.TestCase):
+    def setUp(self):
+        self._system = monitor.system
+        self._stdout = sys.stdout
+        monitor.system = lambda command: 0
+        sys.stdout = self.console = StringIO()
+        # The output wrapper only takes real files
+        self.out = TemporaryFile()
+        self.mon = None
+
+    def tearDown(self):
+        if self.mon:
+            self.mon.shutdown()
+        monitor.system = self._system
+        sys.stdout = self._stdout
+        self.out.close()
+
+    def runMonitor(self, memory, **kwargs):
+        self.mon = monitor.BoardMemoryMonitor(arguments(**kwargs), self.out,
+                                              memory)
+        self.mon.run()
+        self.mon.report()
+
+    def errorCodes(self):
+        self.out.seek(0)
+        return [line for line in self.out.read().splitlines()
+                if '/Error: ' in line and not line.endswith(': 0')]
+
+    def testPollingTakesOneRoundTripPerCycle(self):
+        memory = RecordingMemory()
+        self.runMonitor(memory, cycles=100)
+        self.assertEqual(len(memory.watchedReads()), 100)
+        # The ProgVersion read, then the polling cycles only
+        self.assertEqual(memory.roundTrips, 101)
+        self.assertEqual(memory.keysRead, len(BOARDS) * (1 + 100 * len(KEYS)))
+
+    def testSubscriberReceivesEveryErrorPulse(self):
+        memory = BurstMemory(100)
+        self.runMonitor(memory, events=True, cycles=1)
+        self.assertGreater(memory.pulses, 0)
+        self.assertEqual(len(self.errorCodes()), memory.pulses)
+
+    def testFailedSubscriptionPollsAtRate(self):
+        memory = UnsubscribableMemory()
+        self.runMonitor(memory, events=True, rate=20., cycles=10)
+        self.assertIn('polling instead', self.console.getvalue())
+        self.assertIn('at 20 Hz', self.console.getvalue())
+        reads = memory.watchedReads()
+        self.assertEqual(len(reads), 10)
+        period = (reads[-1] - reads[0]) / (len(reads) - 1)
+        self.assertAlmostEqual(period, 1. / 20, delta=.01)
+
+
+if __name__ == '__main__':
+    unittest.main()